@@ -1,65 +1,1072 @@
+import argparse
+import asyncio
 import csv
+import functools
+import heapq
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import struct
 import sys
+import time
+import urllib.parse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-from util import Node, StackFrontier, QueueFrontier
+# Person <-> movie graph for the loaded dataset, set by load_data
+graph = None
 
-# Maps names to a set of corresponding person_ids
-names = {}
+# Landmark distances for the loaded dataset, if any have been built
+landmarks = None
 
-# Maps person_ids to a dictionary of: name, birth, movies (a set of movie_ids)
-people = {}
+# Binary snapshot of a loaded dataset, written next to its CSV files
+SNAPSHOT_FILE = "degrees.snapshot"
+LANDMARKS_FILE = "degrees.landmarks"
+SNAPSHOT_MAGIC = b"DEGREES\0"
+SNAPSHOT_VERSION = 3
+CSV_FILES = ("people.csv", "movies.csv", "stars.csv")
 
-# Maps movie_ids to a dictionary of: title, year, stars (a set of person_ids)
-movies = {}
+# Columns each delta file needs to add a row and to remove one
+DELTA_COLUMNS = {
+    "people.csv": (("id", "name", "birth"), ("id",)),
+    "movies.csv": (("id", "title", "year"), ("id",)),
+    "stars.csv": (("person_id", "movie_id"), ("person_id", "movie_id"))
+}
 
+# Landmark distance marking people a landmark cannot reach
+UNREACHABLE = 255
 
-def load_data(directory):
+# Most names a fuzzy lookup reads from the trigram index; the commonest
+# trigrams of the query are skipped while the rarer ones are enough
+MAX_GRAM_POSTINGS = 6000
+
+# Names longer than this are indexed by fuzzy lookups as this long
+MAX_NAME_LENGTH = 255
+
+# Most names a fuzzy lookup compares against the query letter by letter
+MAX_FUZZY_CANDIDATES = 50
+
+# Reason phrases for the status codes the server answers with
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+
+class StringTable():
     """
-    Load data from CSV files into memory.
+    Sequence of strings packed into a single UTF-8 buffer, where
+    string `i` is stored in blob[offsets[i]:offsets[i + 1]]. Strings
+    appended later are kept in a plain list after the packed ones.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self.packed = len(offsets) - 1
+        self.extra = []
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        Packs an iterable of strings into a new table.
+        """
+        offsets = array("q", [0])
+        chunks = []
+        size = 0
+        for string in strings:
+            data = string.encode("utf-8")
+            chunks.append(data)
+            size += len(data)
+            offsets.append(size)
+        return cls(b"".join(chunks), offsets)
+
+    def append(self, string):
+        self.extra.append(string)
+
+    def __len__(self):
+        return self.packed + len(self.extra)
+
+    def __getitem__(self, i):
+        if i >= self.packed:
+            return self.extra[i - self.packed]
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+
+class Graph():
+    """
+    Bipartite graph of people and the movies they starred in.
+
+    Every person and movie is referred to by a dense integer index.
+    Edges are stored in compressed sparse row form: the movies of
+    person `p` are person_movies[person_offsets[p]:person_offsets[p + 1]]
+    and the stars of movie `m` are
+    movie_stars[movie_offsets[m]:movie_offsets[m + 1]].
+
+    IMDb ids and names are resolved to indices by binary search over
+    `person_order`, `movie_order` and `name_order`, which hold the
+    indices sorted by person id, movie id and lowercased name.
+
+    For fuzzy name lookups, `name_grams` holds every trigram of the
+    lowercased names in sorted order, and the people whose names
+    contain trigram `g` are gram_people[gram_offsets[g]:gram_offsets[g + 1]],
+    shortest names first by the lengths in `name_lengths`.
+
+    Deltas applied after loading are kept in an overlay: people and
+    movies added since are appended to the string tables and found
+    through `added_people` and `added_movies`, removed ones are listed
+    in `removed_people` and `removed_movies`, and `person_patch` and
+    `movie_patch` replace the edges of every person and movie touched.
     """
-    # Load people
-    with open(f"{directory}/people.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            people[row["id"]] = {
-                "name": row["name"],
-                "birth": row["birth"],
-                "movies": set()
-            }
-            if row["name"].lower() not in names:
-                names[row["name"].lower()] = {row["id"]}
+
+    # Attributes saved in a snapshot, with the typecode of each array
+    STRING_TABLES = (
+        "person_ids", "person_names", "person_births",
+        "movie_ids", "movie_titles", "movie_years", "name_grams"
+    )
+    ARRAYS = {
+        "person_offsets": "q",
+        "person_movies": "i",
+        "movie_offsets": "q",
+        "movie_stars": "i",
+        "person_order": "i",
+        "movie_order": "i",
+        "name_order": "i",
+        "gram_offsets": "q",
+        "gram_people": "i",
+        "name_lengths": "B"
+    }
+
+    def __init__(self, person_ids, person_names, person_births,
+                 movie_ids, movie_titles, movie_years,
+                 person_offsets, person_movies, movie_offsets, movie_stars,
+                 person_order, movie_order, name_order,
+                 name_grams, gram_offsets, gram_people, name_lengths):
+        self.person_ids = person_ids
+        self.person_names = person_names
+        self.person_births = person_births
+        self.movie_ids = movie_ids
+        self.movie_titles = movie_titles
+        self.movie_years = movie_years
+        self.person_offsets = person_offsets
+        self.person_movies = person_movies
+        self.movie_offsets = movie_offsets
+        self.movie_stars = movie_stars
+        self.person_order = person_order
+        self.movie_order = movie_order
+        self.name_order = name_order
+        self.name_grams = name_grams
+        self.gram_offsets = gram_offsets
+        self.gram_people = gram_people
+        self.name_lengths = name_lengths
+        self.gram_index = None
+        self.added_people = {}
+        self.added_movies = {}
+        self.removed_people = set()
+        self.removed_movies = set()
+        self.person_patch = {}
+        self.movie_patch = {}
+
+    @classmethod
+    def from_rows(cls, people_rows, movie_rows, star_rows):
+        """
+        Builds a graph from (id, name, birth), (id, title, year) and
+        (person_id, movie_id) rows. Stars naming an unknown person or
+        movie are skipped.
+        """
+        person_ids, person_names, person_births = [], [], []
+        for person_id, name, birth in people_rows:
+            person_ids.append(person_id)
+            person_names.append(name)
+            person_births.append(birth)
+
+        movie_ids, movie_titles, movie_years = [], [], []
+        for movie_id, title, year in movie_rows:
+            movie_ids.append(movie_id)
+            movie_titles.append(title)
+            movie_years.append(year)
+
+        # Translate the star rows into pairs of indices
+        person_index = {person_id: i for i, person_id in enumerate(person_ids)}
+        movie_index = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+        edge_people = array("i")
+        edge_movies = array("i")
+        for person_id, movie_id in star_rows:
+            p = person_index.get(person_id)
+            m = movie_index.get(movie_id)
+            if p is None or m is None:
+                continue
+            edge_people.append(p)
+            edge_movies.append(m)
+        del person_index, movie_index
+
+        person_offsets, person_movies = build_csr(
+            edge_people, edge_movies, len(person_ids)
+        )
+        movie_offsets, movie_stars = build_csr(
+            edge_movies, edge_people, len(movie_ids)
+        )
+
+        lowered = [name.lower() for name in person_names]
+        name_grams, gram_offsets, gram_people = build_gram_index(lowered)
+        name_lengths = array(
+            "B", (min(len(name), MAX_NAME_LENGTH) for name in lowered)
+        )
+        return cls(
+            StringTable.from_strings(person_ids),
+            StringTable.from_strings(person_names),
+            StringTable.from_strings(person_births),
+            StringTable.from_strings(movie_ids),
+            StringTable.from_strings(movie_titles),
+            StringTable.from_strings(movie_years),
+            person_offsets, person_movies, movie_offsets, movie_stars,
+            sorted_indices(person_ids),
+            sorted_indices(movie_ids),
+            sorted_indices(lowered),
+            name_grams, gram_offsets, gram_people, name_lengths
+        )
+
+    def person_count(self):
+        return len(self.person_ids)
+
+    def movie_count(self):
+        return len(self.movie_ids)
+
+    def movies_of(self, p):
+        """
+        Returns the indices of the movies person `p` starred in.
+        """
+        if self.person_patch and p in self.person_patch:
+            return self.person_patch[p]
+        return self.person_movies[self.person_offsets[p]:self.person_offsets[p + 1]]
+
+    def stars_of(self, m):
+        """
+        Returns the indices of the people who starred in movie `m`.
+        """
+        if self.movie_patch and m in self.movie_patch:
+            return self.movie_patch[m]
+        return self.movie_stars[self.movie_offsets[m]:self.movie_offsets[m + 1]]
+
+    def person_index(self, person_id):
+        """
+        Returns the index of the person with IMDb id `person_id`, or None.
+        """
+        if person_id in self.added_people:
+            return self.added_people[person_id]
+        p = find_index(self.person_order, self.person_ids, person_id)
+        if p in self.removed_people:
+            return None
+        return p
+
+    def movie_index(self, movie_id):
+        """
+        Returns the index of the movie with IMDb id `movie_id`, or None.
+        """
+        if movie_id in self.added_movies:
+            return self.added_movies[movie_id]
+        m = find_index(self.movie_order, self.movie_ids, movie_id)
+        if m in self.removed_movies:
+            return None
+        return m
+
+    def people_named(self, name):
+        """
+        Returns the indices of every person whose name is `name`,
+        ignoring case.
+        """
+        name = name.lower()
+        names = self.person_names
+        order = self.name_order
+        i = bisect_left(order, name, key=lambda p: names[p].lower())
+        matches = []
+        while i < len(order) and names[order[i]].lower() == name:
+            if order[i] not in self.removed_people:
+                matches.append(order[i])
+            i += 1
+        matches.extend(
+            p for p in self.added_people.values()
+            if names[p].lower() == name
+        )
+        return matches
+
+    def people_with_prefix(self, prefix, limit):
+        """
+        Returns the indices of up to `limit` people whose names start
+        with `prefix`, ignoring case, in name order.
+        """
+        prefix = prefix.lower()
+        names = self.person_names
+        order = self.name_order
+        i = bisect_left(order, prefix, key=lambda p: names[p].lower())
+        matches = []
+        while i < len(order) and len(matches) < limit:
+            if not names[order[i]].lower().startswith(prefix):
+                break
+            if order[i] not in self.removed_people:
+                matches.append(order[i])
+            i += 1
+        for p in self.added_people.values():
+            if len(matches) < limit and names[p].lower().startswith(prefix):
+                matches.append(p)
+        return matches
+
+    def people_with_gram(self, gram, shortest=0, longest=MAX_NAME_LENGTH):
+        """
+        Returns the indices of the people whose lowercased names contain
+        the trigram `gram` and are `shortest` to `longest` characters
+        long, shortest names first. People added by a delta are not
+        included.
+        """
+        # Every lookup resolves a dozen or so trigrams, so map them once
+        if self.gram_index is None:
+            grams = self.name_grams
+            self.gram_index = {grams[g]: g for g in range(len(grams))}
+        g = self.gram_index.get(gram)
+        if g is None:
+            return ()
+        start, end = self.gram_offsets[g], self.gram_offsets[g + 1]
+        length = self.name_lengths.__getitem__
+        people = self.gram_people
+        start = bisect_left(people, shortest, start, end, key=length)
+        end = bisect_right(people, longest, start, end, key=length)
+        return people[start:end]
+
+    def add_person(self, person_id, name, birth):
+        """
+        Adds a person with no movies, unless `person_id` is already taken.
+        """
+        if self.person_index(person_id) is not None:
+            return
+        p = len(self.person_ids)
+        self.person_ids.append(person_id)
+        self.person_names.append(name)
+        self.person_births.append(birth)
+        self.added_people[person_id] = p
+        self.person_patch[p] = ()
+
+    def add_movie(self, movie_id, title, year):
+        """
+        Adds a movie with no stars, unless `movie_id` is already taken.
+        """
+        if self.movie_index(movie_id) is not None:
+            return
+        m = len(self.movie_ids)
+        self.movie_ids.append(movie_id)
+        self.movie_titles.append(title)
+        self.movie_years.append(year)
+        self.added_movies[movie_id] = m
+        self.movie_patch[m] = ()
+
+    def remove_person(self, person_id):
+        """
+        Removes a person along with every movie credit they have.
+        """
+        p = self.person_index(person_id)
+        if p is None:
+            return
+        for m in self.movies_of(p):
+            self.movie_patch[m] = tuple(s for s in self.stars_of(m) if s != p)
+        self.person_patch[p] = ()
+        self.added_people.pop(person_id, None)
+        self.removed_people.add(p)
+
+    def remove_movie(self, movie_id):
+        """
+        Removes a movie along with every credit for it.
+        """
+        m = self.movie_index(movie_id)
+        if m is None:
+            return
+        for p in self.stars_of(m):
+            self.person_patch[p] = tuple(n for n in self.movies_of(p) if n != m)
+        self.movie_patch[m] = ()
+        self.added_movies.pop(movie_id, None)
+        self.removed_movies.add(m)
+
+    def add_star(self, person_id, movie_id):
+        """
+        Credits a person for a movie. Credits naming an unknown person or
+        movie are skipped, as when loading.
+        """
+        p = self.person_index(person_id)
+        m = self.movie_index(movie_id)
+        if p is None or m is None or m in self.movies_of(p):
+            return
+        self.person_patch[p] = tuple(self.movies_of(p)) + (m,)
+        self.movie_patch[m] = tuple(self.stars_of(m)) + (p,)
+
+    def remove_star(self, person_id, movie_id):
+        """
+        Removes a person's credit for a movie.
+        """
+        p = self.person_index(person_id)
+        m = self.movie_index(movie_id)
+        if p is None or m is None or m not in self.movies_of(p):
+            return
+        self.person_patch[p] = tuple(n for n in self.movies_of(p) if n != m)
+        self.movie_patch[m] = tuple(s for s in self.stars_of(m) if s != p)
+
+    def apply_changes(self, changes):
+        """
+        Applies rows read by read_delta to the graph.
+        """
+        operations = {
+            "people.csv": (
+                lambda row: self.add_person(row["id"], row["name"], row["birth"]),
+                lambda row: self.remove_person(row["id"])
+            ),
+            "movies.csv": (
+                lambda row: self.add_movie(row["id"], row["title"], row["year"]),
+                lambda row: self.remove_movie(row["id"])
+            ),
+            "stars.csv": (
+                lambda row: self.add_star(row["person_id"], row["movie_id"]),
+                lambda row: self.remove_star(row["person_id"], row["movie_id"])
+            )
+        }
+        for filename, op, row in changes:
+            add, remove = operations[filename]
+            if op == "+":
+                add(row)
             else:
-                names[row["name"].lower()].add(row["id"])
-
-    # Load movies
-    with open(f"{directory}/movies.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            movies[row["id"]] = {
-                "title": row["title"],
-                "year": row["year"],
-                "stars": set()
-            }
-
-    # Load stars
-    with open(f"{directory}/stars.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                people[row["person_id"]]["movies"].add(row["movie_id"])
-                movies[row["movie_id"]]["stars"].add(row["person_id"])
-            except KeyError:
-                pass
+                remove(row)
+
+    def compacted(self):
+        """
+        Returns a new graph holding the same data with the overlay of
+        applied deltas folded into its arrays.
+        """
+        people = [
+            p for p in range(self.person_count())
+            if p not in self.removed_people
+        ]
+        movies = [
+            m for m in range(self.movie_count())
+            if m not in self.removed_movies
+        ]
+        return Graph.from_rows(
+            ((self.person_ids[p], self.person_names[p], self.person_births[p])
+             for p in people),
+            ((self.movie_ids[m], self.movie_titles[m], self.movie_years[m])
+             for m in movies),
+            ((self.person_ids[p], self.movie_ids[m])
+             for m in movies for p in self.stars_of(m))
+        )
+
+    def person(self, person_id):
+        """
+        Returns a dictionary of: name, birth for the person with IMDb id
+        `person_id`.
+        """
+        p = self.person_index(person_id)
+        if p is None:
+            raise KeyError(person_id)
+        return {
+            "name": self.person_names[p],
+            "birth": self.person_births[p]
+        }
+
+    def movie(self, movie_id):
+        """
+        Returns a dictionary of: title, year for the movie with IMDb id
+        `movie_id`.
+        """
+        m = self.movie_index(movie_id)
+        if m is None:
+            raise KeyError(movie_id)
+        return {
+            "title": self.movie_titles[m],
+            "year": self.movie_years[m]
+        }
+
+
+def build_csr(sources, targets, count):
+    """
+    Groups the edges sources[i] -> targets[i] by source, returning
+    the offsets and indices arrays of their compressed sparse row form.
+    """
+    offsets = array("q", bytes(8 * (count + 1)))
+    for s in sources:
+        offsets[s + 1] += 1
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+
+    indices = array("i", bytes(4 * len(sources)))
+    cursor = offsets[:-1]
+    for s, t in zip(sources, targets):
+        indices[cursor[s]] = t
+        cursor[s] += 1
+    return offsets, indices
+
+
+def trigrams(name):
+    """
+    Returns the set of three-character substrings of `name`, padded
+    with a space at each end so that starts and ends of names count.
+    """
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_gram_index(names):
+    """
+    Returns the sorted trigrams of `names` as a StringTable, along with
+    the offsets and indices arrays listing the names containing each.
+    """
+    gram_ids = {}
+    edge_grams = array("i")
+    edge_names = array("i")
+    # Listing the names shortest first lets lookups skip by length
+    for i in sorted(range(len(names)), key=lambda i: len(names[i])):
+        for gram in trigrams(names[i]):
+            edge_grams.append(gram_ids.setdefault(gram, len(gram_ids)))
+            edge_names.append(i)
+
+    # Renumber the trigrams in sorted order so they can be binary searched
+    grams = sorted(gram_ids)
+    rank = array("i", bytes(4 * len(grams)))
+    for i, gram in enumerate(grams):
+        rank[gram_ids[gram]] = i
+    for i, g in enumerate(edge_grams):
+        edge_grams[i] = rank[g]
+
+    offsets, postings = build_csr(edge_grams, edge_names, len(grams))
+    return StringTable.from_strings(grams), offsets, postings
+
+
+def sorted_indices(keys):
+    """
+    Returns an array of the indices of `keys` in sorted key order.
+    """
+    return array("i", sorted(range(len(keys)), key=keys.__getitem__))
+
+
+def find_index(order, keys, key):
+    """
+    Returns the index i with keys[i] == key, using `order` as the
+    indices of `keys` in sorted order, or None if there is none.
+    """
+    i = bisect_left(order, key, key=keys.__getitem__)
+    if i < len(order) and keys[order[i]] == key:
+        return order[i]
+    return None
+
+
+def load_data(directory, use_snapshot=True):
+    """
+    Load data from CSV files into memory.
+
+    Unless `use_snapshot` is False, the loaded graph is saved to a
+    binary snapshot in `directory`, and later calls memory-map that
+    snapshot instead of parsing the CSV files again for as long as
+    the files keep the same modification times and sizes. Landmark
+    distances saved by save_landmarks for the same files are mapped
+    too.
+    """
+    global graph, landmarks
+
+    signature = csv_signature(directory)
+    landmarks = None
+    if use_snapshot:
+        graph = read_snapshot(os.path.join(directory, SNAPSHOT_FILE), signature)
+        if graph is not None:
+            landmarks = read_landmarks(
+                os.path.join(directory, LANDMARKS_FILE), signature
+            )
+            return
+
+    with open(f"{directory}/people.csv", encoding="utf-8") as people_file, \
+            open(f"{directory}/movies.csv", encoding="utf-8") as movies_file, \
+            open(f"{directory}/stars.csv", encoding="utf-8") as stars_file:
+        graph = Graph.from_rows(
+            ((row["id"], row["name"], row["birth"])
+             for row in csv.DictReader(people_file)),
+            ((row["id"], row["title"], row["year"])
+             for row in csv.DictReader(movies_file)),
+            ((row["person_id"], row["movie_id"])
+             for row in csv.DictReader(stars_file))
+        )
+
+    if use_snapshot:
+        try:
+            write_snapshot(graph, os.path.join(directory, SNAPSHOT_FILE), signature)
+        except OSError:
+            # A read-only dataset directory just means no snapshot
+            pass
+
+
+def csv_signature(directory):
+    """
+    Returns the modification time and size of each CSV file in
+    `directory`, used to tell whether a snapshot is still current.
+    """
+    signature = []
+    for filename in CSV_FILES:
+        stat = os.stat(os.path.join(directory, filename))
+        signature.append([filename, stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def write_snapshot(graph, path, signature):
+    """
+    Writes every table of `graph` to a snapshot file at `path`.
+    """
+    tables = []
+    for name in Graph.STRING_TABLES:
+        table = getattr(graph, name)
+        tables.append((f"{name}.blob", "B", table.blob))
+        tables.append((f"{name}.offsets", "q", table.offsets))
+    for name, typecode in Graph.ARRAYS.items():
+        tables.append((name, typecode, getattr(graph, name)))
+    write_tables(path, signature, tables)
+
+
+def read_snapshot(path, signature):
+    """
+    Memory-maps the snapshot at `path` and returns a Graph whose
+    tables are views into it, or None if there is no usable snapshot
+    matching `signature`.
+    """
+    sections = read_tables(path, signature)
+    if sections is None:
+        return None
+
+    tables = {}
+    try:
+        for name in Graph.STRING_TABLES:
+            tables[name] = StringTable(
+                sections[f"{name}.blob"], sections[f"{name}.offsets"]
+            )
+        for name in Graph.ARRAYS:
+            tables[name] = sections[name]
+    except KeyError:
+        return None
+    return Graph(**tables)
+
+
+def write_tables(path, signature, tables):
+    """
+    Writes the (name, typecode, data) arrays in `tables` to `path`.
+
+    The file starts with a magic string, the format version and the
+    length of a JSON header, followed by the header itself, which
+    records `signature` and where each table is stored. Tables follow
+    as raw native-endian arrays, each aligned to 8 bytes so they can
+    be memory-mapped in place.
+    """
+    sections = {}
+    position = 0
+    for name, typecode, data in tables:
+        size = memoryview(data).nbytes
+        sections[name] = [position, size, typecode]
+        position += align(size)
+
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "signature": signature,
+        "sections": sections
+    }).encode("utf-8")
+    preamble = SNAPSHOT_MAGIC + struct.pack("<II", SNAPSHOT_VERSION, len(header))
+    start = align(len(preamble) + len(header))
+
+    # Write to a temporary file first so readers never see a partial file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(preamble + header)
+            f.write(bytes(start - len(preamble) - len(header)))
+            for name, typecode, data in tables:
+                data = memoryview(data).cast("B")
+                f.write(data)
+                f.write(bytes(align(len(data)) - len(data)))
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def read_tables(path, signature):
+    """
+    Memory-maps a file written by write_tables and returns a dictionary
+    of its tables as views into the mapping, or None if the file is
+    missing, damaged, or was written for a different `signature`.
+    """
+    try:
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        preamble = len(SNAPSHOT_MAGIC) + 8
+        if mapping[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            return None
+        version, header_size = struct.unpack(
+            "<II", mapping[len(SNAPSHOT_MAGIC):preamble]
+        )
+        if version != SNAPSHOT_VERSION:
+            return None
+        header = json.loads(mapping[preamble:preamble + header_size])
+        if header["byteorder"] != sys.byteorder or \
+                header["signature"] != signature:
+            return None
+
+        view = memoryview(mapping)
+        start = align(preamble + header_size)
+        sections = {}
+        for name, (position, size, typecode) in header["sections"].items():
+            offset = start + position
+            if offset + size > len(mapping):
+                return None
+            sections[name] = view[offset:offset + size].cast(typecode)
+    except (ValueError, KeyError, TypeError, struct.error):
+        return None
+    return sections
+
+
+def align(size):
+    """
+    Rounds `size` up to a multiple of 8 bytes.
+    """
+    return (size + 7) & ~7
+
+
+class Landmarks():
+    """
+    Exact distances, in degrees, from a few landmark people to everyone
+    else. Row `i` of `distances` holds the distance from landmark
+    `people[i]` to every person index, or UNREACHABLE.
+    """
+
+    def __init__(self, people, distances):
+        self.people = people
+        self.distances = distances
+        count = graph.person_count()
+        self.rows = [
+            distances[i * count:(i + 1) * count] for i in range(len(people))
+        ]
+
+    def bounds(self, s, t):
+        """
+        Returns a (lower, upper) bound on the degrees between person
+        indices `s` and `t`. The lower bound is math.inf when a landmark
+        reaches one but not the other, and the upper bound is math.inf
+        when no landmark reaches both.
+        """
+        lower = 0
+        upper = math.inf
+        for row in self.rows:
+            ds = row[s]
+            dt = row[t]
+            if ds == UNREACHABLE or dt == UNREACHABLE:
+                if ds != dt:
+                    return math.inf, math.inf
+                continue
+            lower = max(lower, abs(ds - dt))
+            upper = min(upper, ds + dt)
+        return lower, upper
+
+    def heuristic(self, t):
+        """
+        Returns a function estimating the degrees from a person index to
+        `t` without overestimating, or returning math.inf for people
+        that provably cannot reach `t`.
+        """
+        targets = [(row, row[t]) for row in self.rows]
+
+        def estimate(p):
+            best = 0
+            for row, dt in targets:
+                dp = row[p]
+                if dp == UNREACHABLE or dt == UNREACHABLE:
+                    if dp != dt:
+                        return math.inf
+                    continue
+                if dp > dt:
+                    dp, dt = dt, dp
+                if dt - dp > best:
+                    best = dt - dp
+            return best
+
+        return estimate
+
+
+def build_landmarks(count):
+    """
+    Picks `count` landmarks among the people who starred in the most
+    movies, skipping anyone who shares a movie with an earlier pick,
+    and runs a full breadth-first search from each of them.
+    """
+    people_count = graph.person_count()
+    offsets = graph.person_offsets
+    candidates = sorted(
+        range(people_count),
+        key=lambda p: offsets[p + 1] - offsets[p],
+        reverse=True
+    )
+
+    chosen = array("i")
+    distances = array("B")
+    for p in candidates:
+        if len(chosen) == count:
+            break
+        if any(
+            distances[i * people_count + p] <= 1 for i in range(len(chosen))
+        ):
+            continue
+        chosen.append(p)
+        distances.extend(breadth_first_distances(p))
+    return Landmarks(chosen, distances)
+
+
+def breadth_first_distances(source):
+    """
+    Returns an array of the degrees from person index `source` to every
+    person index, or UNREACHABLE.
+    """
+    movies_of = graph.movies_of
+    stars_of = graph.stars_of
+    distances = array("B", [UNREACHABLE]) * graph.person_count()
+    seen_movies = bytearray(graph.movie_count())
+
+    distances[source] = 0
+    frontier = [source]
+    depth = 0
+    while frontier and depth < UNREACHABLE - 1:
+        depth += 1
+        next_frontier = []
+        for p in frontier:
+            for m in movies_of(p):
+                if seen_movies[m]:
+                    continue
+                seen_movies[m] = 1
+                for neighbor in stars_of(m):
+                    if distances[neighbor] == UNREACHABLE:
+                        distances[neighbor] = depth
+                        next_frontier.append(neighbor)
+        frontier = next_frontier
+    return distances
+
+
+def save_landmarks(directory, count):
+    """
+    Builds `count` landmarks for the loaded graph, keeps them in use and
+    saves them next to the snapshot of `directory`.
+    """
+    global landmarks
+
+    landmarks = build_landmarks(count)
+    write_tables(
+        os.path.join(directory, LANDMARKS_FILE),
+        csv_signature(directory),
+        [("people", "i", landmarks.people),
+         ("distances", "B", landmarks.distances)]
+    )
+
+
+def read_landmarks(path, signature):
+    """
+    Memory-maps landmarks saved by save_landmarks, or returns None if
+    there are none for the current data.
+    """
+    sections = read_tables(path, signature)
+    if sections is None or "people" not in sections or \
+            len(sections["distances"]) != \
+            len(sections["people"]) * graph.person_count():
+        return None
+    return Landmarks(sections["people"], sections["distances"])
+
+
+def distance_bounds(source, target):
+    """
+    Returns a (lower, upper) bound on the degrees of separation between
+    the people with IMDb ids `source` and `target`, using the loaded
+    landmarks. A lower bound of math.inf means they are not connected;
+    an upper bound of math.inf means no bound is known.
+    """
+    s = graph.person_index(source)
+    t = graph.person_index(target)
+    if s is None or t is None:
+        raise KeyError(source if s is None else target)
+    if s == t:
+        return 0, 0
+    if landmarks is None:
+        return 0, math.inf
+    return landmarks.bounds(s, t)
+
+
+def apply_delta(delta_directory, directory=None):
+    """
+    Applies the changes in `delta_directory` to the loaded graph.
+
+    The delta directory holds any of people.csv, movies.csv and
+    stars.csv, with the usual columns plus an `op` column that is "+"
+    to add the row or "-" to remove it. Removing a person or movie also
+    removes their credits. Rows are applied file by file, in order.
+    The whole delta is read and checked first, so a delta with a bad
+    row raises ValueError without changing anything.
+
+    Loaded landmarks no longer hold once the graph changes, so they are
+    dropped. If `directory` is given, its snapshot is rewritten with the
+    changes folded in and its saved landmarks are deleted.
+    """
+    global landmarks
+
+    graph.apply_changes(read_delta(delta_directory))
+    landmarks = None
+    if directory is not None:
+        save_changes(directory)
+
+
+def read_delta(delta_directory):
+    """
+    Returns the rows of the delta in `delta_directory` as a list of
+    (filename, op, row) tuples, in the order they are to be applied.
+    Raises ValueError if the directory holds none of the delta files,
+    or for a row with an unknown operation or without a column its
+    operation needs.
+    """
+    paths = [
+        (filename, os.path.join(delta_directory, filename))
+        for filename in CSV_FILES
+    ]
+    paths = [(filename, path) for filename, path in paths if os.path.exists(path)]
+    if not paths:
+        raise ValueError(
+            f"No {', '.join(CSV_FILES)} delta files in {delta_directory}"
+        )
+
+    changes = []
+    for filename, path in paths:
+        add_columns, remove_columns = DELTA_COLUMNS[filename]
+        with open(path, encoding="utf-8") as f:
+            for line, row in enumerate(csv.DictReader(f), 2):
+                op = (row.get("op") or "").strip()
+                if op not in ("+", "-"):
+                    raise ValueError(f"Unknown delta operation '{op}' in {path}")
+                columns = add_columns if op == "+" else remove_columns
+                missing = [column for column in columns if row.get(column) is None]
+                if missing:
+                    raise ValueError(
+                        f"Line {line} of {path} has no {', '.join(missing)}"
+                    )
+                changes.append((filename, op, row))
+    return changes
+
+
+def save_changes(directory, changed=None):
+    """
+    Rewrites the snapshot of `directory` from `changed`, by default the
+    loaded graph, with the changes applied to it folded in, and deletes
+    its saved landmarks.
+    """
+    changed = graph if changed is None else changed
+    write_snapshot(
+        changed.compacted(),
+        os.path.join(directory, SNAPSHOT_FILE),
+        csv_signature(directory)
+    )
+    try:
+        os.remove(os.path.join(directory, LANDMARKS_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def save_delta(directory, changes):
+    """
+    Rewrites the snapshot of `directory` with rows read by read_delta
+    folded in, as save_changes does, without changing the loaded graph.
+    Raises OSError if there is no current snapshot to start from.
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    changed = read_snapshot(path, csv_signature(directory))
+    if changed is None:
+        raise OSError(f"No current snapshot at {path}")
+    changed.apply_changes(changes)
+    save_changes(directory, changed)
 
 
 def main():
-    if len(sys.argv) > 2:
-        sys.exit("Usage: python degrees.py [directory]")
-    directory = sys.argv[1] if len(sys.argv) == 2 else "large"
+    parser = argparse.ArgumentParser(
+        description="Find the degrees of separation between two people."
+    )
+    parser.add_argument("directory", nargs="?", default="large")
+    parser.add_argument(
+        "--batch", metavar="FILE",
+        help="answer every pair of names or ids in FILE as JSON lines"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="number of processes answering --batch queries"
+    )
+    parser.add_argument(
+        "--build-landmarks", type=int, metavar="COUNT",
+        help="precompute distances from COUNT landmark people and exit"
+    )
+    parser.add_argument(
+        "--delta", metavar="DIR", action="append", default=[],
+        help="apply the changes in DIR to the saved snapshot before doing "
+             "anything else; may be repeated"
+    )
+    parser.add_argument(
+        "--lookup", metavar="NAME",
+        help="print the people best matching NAME as JSON lines and exit"
+    )
+    parser.add_argument(
+        "--serve", type=int, metavar="PORT",
+        help="answer /path and /lookup HTTP requests on PORT"
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="address the --serve server listens on"
+    )
+    args = parser.parse_args()
+
+    # Later modes load the updated snapshot, so only stay when one was asked for
+    if args.delta:
+        load_data(args.directory)
+        for delta_directory in args.delta:
+            try:
+                apply_delta(delta_directory, args.directory)
+            except ValueError as error:
+                sys.exit(f"Could not apply {delta_directory}: {error}")
+        print(f"Applied {len(args.delta)} delta(s).", file=sys.stderr)
+        if args.lookup is None and args.serve is None and \
+                args.build_landmarks is None and args.batch is None:
+            return
+
+    if args.lookup is not None:
+        load_data(args.directory)
+        for candidate in lookup(args.lookup):
+            print(json.dumps(candidate))
+        return
+
+    if args.serve is not None:
+        serve(args.directory, args.host, args.serve, args.workers)
+        return
+
+    if args.build_landmarks is not None:
+        load_data(args.directory)
+        save_landmarks(args.directory, args.build_landmarks)
+        print(f"Saved {len(landmarks.people)} landmarks.")
+        return
+
+    if args.batch is not None:
+        with open(args.batch, encoding="utf-8") as f:
+            run_batch(args.directory, f, sys.stdout, args.workers)
+        return
 
     # Load data from files into memory
     print("Loading data...")
-    load_data(directory)
+    load_data(args.directory)
     print("Data loaded.")
 
     source = person_id_for_name(input("Name: "))
@@ -78,69 +1085,604 @@ def main():
         print(f"{degrees} degrees of separation.")
         path = [(None, source)] + path
         for i in range(degrees):
-            person1 = people[path[i][1]]["name"]
-            person2 = people[path[i + 1][1]]["name"]
-            movie = movies[path[i + 1][0]]["title"]
+            person1 = graph.person(path[i][1])["name"]
+            person2 = graph.person(path[i + 1][1])["name"]
+            movie = graph.movie(path[i + 1][0])["title"]
             print(f"{i + 1}: {person1} and {person2} starred in {movie}")
 
 
+def run_batch(directory, pairs, output, workers):
+    """
+    Answers every (source, target) row of the CSV stream `pairs`,
+    writing one JSON object per line to `output` in input order.
+    Sources and targets may be IMDb ids or names.
+
+    Queries are spread over `workers` processes. Each worker maps the
+    same snapshot of `directory` (or inherits the parent's graph when
+    processes are forked), so the graph is shared read-only rather than
+    copied. Throughput is reported on stderr.
+    """
+    load_data(directory)
+    rows = (row for row in csv.reader(pairs) if row)
+
+    start = time.perf_counter()
+    count = 0
+    if workers <= 1:
+        answers = map(answer_query, rows)
+        for answer in answers:
+            output.write(json.dumps(answer) + "\n")
+            count += 1
+    else:
+        with multiprocessing.Pool(
+            workers, initializer=init_worker, initargs=(directory,)
+        ) as pool:
+            for answer in pool.imap(answer_query, rows, chunksize=64):
+                output.write(json.dumps(answer) + "\n")
+                count += 1
+    elapsed = time.perf_counter() - start
+
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{count} queries in {elapsed:.2f}s ({rate:.1f} queries/s)",
+          file=sys.stderr)
+
+
+def init_worker(directory):
+    """
+    Loads the graph in a batch worker, unless it was forked with one.
+    """
+    if graph is None:
+        load_data(directory)
+
+
+def answer_query(row):
+    """
+    Returns a JSON-ready dictionary answering one batch query row.
+    """
+    if len(row) != 2:
+        return {"query": row, "error": "Expected a source and a target."}
+    source, target = row
+
+    answer = {"source": source, "target": target}
+    source_id = resolve_person(source)
+    target_id = resolve_person(target)
+    if source_id is None or target_id is None:
+        missing = source if source_id is None else target
+        answer["error"] = f"No single person found for '{missing}'."
+        return answer
+
+    path = shortest_path(source_id, target_id)
+    answer["source_id"] = source_id
+    answer["target_id"] = target_id
+    answer["degrees"] = None if path is None else len(path)
+    answer["path"] = path
+    return answer
+
+
+def resolve_person(text):
+    """
+    Returns the IMDb id for `text`, which may be an id or a name,
+    without prompting. Returns None if no single person matches.
+    """
+    text = text.strip()
+    if graph.person_index(text) is not None:
+        return text
+    candidates = find_people(text, 2)
+    if not candidates:
+        return None
+
+    # Accept the best candidate only when nothing else is as good
+    p, match, distance = candidates[0]
+    if match == "prefix":
+        return None
+    if len(candidates) > 1 and candidates[1][1:] == (match, distance):
+        return None
+    return graph.person_ids[p]
+
+
+def serve(directory, host, port, workers):
+    """
+    Loads the graph once and answers HTTP requests until interrupted:
+
+        GET /path?source=...&target=...   shortest path, as in --batch
+        GET /lookup?name=...              people matching a name
+        POST /delta?path=...              apply a delta directory
+
+    Lookups are answered on the event loop, while path searches run on
+    a pool of `workers` processes sharing the graph, so a slow search
+    never holds up other requests. A delta is read, checked and folded
+    into a new snapshot on a thread, one delta at a time, while requests
+    are still answered from the graph before it. Once the snapshot is
+    saved, it is loaded in place of that graph and the pool is replaced,
+    so lookups and searches move to the updated graph together. A delta
+    that cannot be saved is not applied.
+    """
+    load_data(directory)
+    try:
+        asyncio.run(run_server(directory, host, port, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_server(directory, host, port, workers):
+    pool = {
+        "directory": directory,
+        "workers": workers,
+        "executor": start_pool(directory, workers),
+        "delta_lock": asyncio.Lock()
+    }
+    try:
+        server = await asyncio.start_server(
+            functools.partial(handle_connection, pool), host, port
+        )
+        print(f"Serving on http://{host}:{port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool["executor"].shutdown()
+
+
+def start_pool(directory, workers):
+    return ProcessPoolExecutor(
+        max(workers, 1), initializer=init_worker, initargs=(directory,)
+    )
+
+
+async def handle_connection(pool, reader, writer):
+    """
+    Answers HTTP/1.1 requests on one connection until the client closes
+    it or asks not to keep it alive.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            # Bodies are never used, but must be skipped to reach the next request
+            length = headers.get("content-length", "0")
+            if length.isdigit() and int(length) > 0:
+                await reader.readexactly(int(length))
+
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                status, body = 400, {"error": "Malformed request."}
+                version = "HTTP/1.0"
+            else:
+                status, body = await respond(pool, method, target)
+
+            keep_alive = version == "HTTP/1.1" and \
+                headers.get("connection", "").lower() != "close"
+            payload = json.dumps(body).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def respond(pool, method, target):
+    """
+    Returns the status code and JSON body answering one request.
+    """
+    url = urllib.parse.urlsplit(target)
+    query = {
+        key: values[0]
+        for key, values in urllib.parse.parse_qs(url.query).items()
+    }
+
+    if url.path == "/delta":
+        if method != "POST":
+            return 405, {"error": "Deltas must be POSTed."}
+        if "path" not in query:
+            return 400, {"error": "Expected a path parameter."}
+        loop = asyncio.get_running_loop()
+        async with pool["delta_lock"]:
+            try:
+                changes = await loop.run_in_executor(None, read_delta, query["path"])
+            except (OSError, ValueError) as error:
+                return 400, {"error": f"Could not apply delta: {error}"}
+
+            try:
+                await loop.run_in_executor(
+                    None, save_delta, pool["directory"], changes
+                )
+            except OSError as error:
+                return 500, {"error": f"Could not save delta: {error}"}
+
+            # Swap in the saved graph and only then start the new workers,
+            # which load that same snapshot whether forked or spawned.
+            # Nothing else runs on the event loop in between, so lookups
+            # and new searches see the same graph
+            load_data(pool["directory"])
+            old = pool["executor"]
+            pool["executor"] = start_pool(pool["directory"], pool["workers"])
+            old.shutdown(wait=False)
+            # Fork the new workers before a later delta starts a thread
+            pool["executor"].submit(int)
+        return 200, {"applied": query["path"]}
+
+    if method != "GET":
+        return 405, {"error": "Only GET is supported."}
+
+    if url.path == "/path":
+        if "source" not in query or "target" not in query:
+            return 400, {"error": "Expected source and target parameters."}
+        loop = asyncio.get_running_loop()
+        answer = await loop.run_in_executor(
+            pool["executor"], answer_query, [query["source"], query["target"]]
+        )
+        return (404 if "error" in answer else 200), answer
+
+    if url.path == "/lookup":
+        if "name" not in query:
+            return 400, {"error": "Expected a name parameter."}
+        return 200, {"name": query["name"], "matches": lookup(query["name"])}
+
+    return 404, {"error": f"No such endpoint '{url.path}'."}
+
+
+def lookup(name, limit=10):
+    """
+    Returns a list of dictionaries of: id, name, birth, match, distance
+    for the people found by find_people.
+    """
+    return [
+        {
+            "id": graph.person_ids[p],
+            "name": graph.person_names[p],
+            "birth": graph.person_births[p],
+            "match": match,
+            "distance": distance
+        }
+        for p, match, distance in find_people(name, limit)
+    ]
+
+
+def find_people(query, limit=10):
+    """
+    Returns up to `limit` (person index, match, distance) candidates for
+    the name `query`, best first. `match` is "exact" for names equal
+    to the query ignoring case, "prefix" for names starting with it and
+    "fuzzy" for names within one or two edits of it; `distance` is the
+    edit distance between the query and the name. Near misses are only
+    looked for when there is no exact match.
+    """
+    query = " ".join(query.lower().split())
+    if not query:
+        return []
+
+    candidates = []
+    seen = set()
+    for p in graph.people_named(query):
+        candidates.append((p, "exact", 0))
+        seen.add(p)
+    for p in graph.people_with_prefix(query, limit):
+        if p not in seen:
+            distance = len(graph.person_names[p]) - len(query)
+            candidates.append((p, "prefix", distance))
+            seen.add(p)
+    if len(candidates) >= limit or exact_found(candidates):
+        return candidates[:limit]
+
+    # Names within `allowed` edits of the query share at least `needed`
+    # of its trigrams, since each edit changes at most three of them
+    grams = trigrams(query)
+    allowed = 1 if len(query) <= 8 else 2
+    needed = len(grams) - 3 * allowed
+
+    # Count shared trigrams among names of a near enough length, rarest
+    # trigrams first, leaving out the most common ones while the rest
+    # can still meet the threshold
+    shortest, longest = len(query) - allowed, len(query) + allowed
+    postings = sorted(
+        (graph.people_with_gram(gram, shortest, longest) for gram in grams),
+        key=len
+    )
+    walk = sum(map(len, postings))
+    while len(postings) > 1 and needed > 1 and walk > MAX_GRAM_POSTINGS:
+        walk -= len(postings.pop())
+        needed -= 1
+    # A name sharing `needed` of the trigrams is in one of the rarest
+    # lists, so the commoner ones only count names already found
+    rare = len(postings) - needed + 1
+    shared = Counter()
+    for people in postings[:rare]:
+        shared.update(people[:MAX_GRAM_POSTINGS])
+    for people in postings[rare:]:
+        shared.update(shared.keys() & people[:MAX_GRAM_POSTINGS])
+
+    # Only the names sharing the most trigrams are worth an edit distance
+    likely = [p for p, count in shared.items() if count >= needed]
+    if len(likely) > MAX_FUZZY_CANDIDATES:
+        likely = heapq.nlargest(
+            MAX_FUZZY_CANDIDATES + len(seen), likely, key=shared.__getitem__
+        )
+    likely = [
+        p for p in likely
+        if p not in seen and p not in graph.removed_people
+    ][:MAX_FUZZY_CANDIDATES]
+
+    # People added by a delta are missing from the trigram index
+    likely.extend(p for p in graph.added_people.values() if p not in seen)
+
+    # Many people share a name, so measure each distinct name once
+    fuzzy = []
+    distances = {}
+    names = graph.person_names
+    for p in likely:
+        name = names[p]
+        if name not in distances:
+            distances[name] = edit_distance(query, name.lower(), allowed)
+        if distances[name] <= allowed:
+            fuzzy.append((distances[name], -shared[p], name, p))
+    fuzzy.sort()
+    for distance, _, _, p in fuzzy[:limit - len(candidates)]:
+        candidates.append((p, "fuzzy", distance))
+    return candidates
+
+
+def exact_found(candidates):
+    """
+    Returns True if find_people candidates include an exact match,
+    in which case near misses are not worth looking for.
+    """
+    return any(match == "exact" for _, match, _ in candidates)
+
+
+def edit_distance(a, b, limit):
+    """
+    Returns the Levenshtein distance between `a` and `b`, or limit + 1
+    once it is known to exceed `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a:
+        return len(b)
+
+    # Myers' bit-parallel algorithm: one column of the edit distance
+    # table per character of `b`, with bit i of `plus` and `minus` set
+    # where row i is one more or one less than the row above it
+    positions, full, last = bit_positions(a)
+    plus, minus, distance = full, 0, len(a)
+    for char in b:
+        equal = positions.get(char, 0)
+        vertical = equal | minus
+        horizontal = (((equal & plus) + plus) ^ plus) | equal
+        up = minus | ~(horizontal | plus) & full
+        down = plus & horizontal
+        if up & last:
+            distance += 1
+        elif down & last:
+            distance -= 1
+        up = (up << 1 | 1) & full
+        down = (down << 1) & full
+        plus = down | ~(vertical | up) & full
+        minus = up & vertical
+    return distance if distance <= limit else limit + 1
+
+
+@functools.lru_cache(maxsize=16)
+def bit_positions(a):
+    """
+    Returns, for edit_distance, a mask of where each character occurs
+    in `a`, a mask of every position and a mask of the last position.
+    Lookups compare one query with many names, so these are cached.
+    """
+    positions = {}
+    for i, char in enumerate(a):
+        positions[char] = positions.get(char, 0) | 1 << i
+    return positions, (1 << len(a)) - 1, 1 << (len(a) - 1)
+
+
 def shortest_path(source, target):
     """
     Returns the shortest list of (movie_id, person_id) pairs
     that connect the source to the target.
 
     If no possible path, returns None.
+
     """
-    # Initialize frontier to just the starting position
-    start = Node(state=source, parent=None, action=None)
-    frontier = QueueFrontier()
-    frontier.add(start)
+    s = graph.person_index(source)
+    t = graph.person_index(target)
+    if s is None or t is None:
+        return None
 
-    # Initialize an empty explored set
-    explored = set()
+    path = shortest_index_path(s, t)
+    if path is None:
+        return None
+    return [(graph.movie_ids[m], graph.person_ids[p]) for m, p in path]
 
-    # Initialize an empty list
-    list_of_pairs = []
 
-    # Keep looping until solution found
-    while True:
+def shortest_index_path(source, target):
+    """
+    Returns the shortest list of (movie, person) index pairs
+    that connect the source index to the target index.
+
+    If no possible path, returns None.
 
-        # If nothing left in frontier, then no path
-        if frontier.empty():
+    Searches outward from both the source and the target at once,
+    always expanding the smaller of the two frontiers by one full
+    level, and joins the two halves where they meet. Movies are
+    nodes of the search too, so each movie's cast is scanned at most
+    once per side however many of its stars are reached.
+
+    When landmarks are loaded, people they show to be disconnected are
+    rejected without searching. When their bounds pin the path length
+    down exactly, each side only expands people whose landmark estimate
+    of the remaining distance still fits it. Estimating costs a pass
+    over the landmarks for every person, which looser bounds rarely
+    repay.
+    """
+    if source == target:
+        return []
+
+    forward_estimate = backward_estimate = None
+    upper = math.inf
+    if landmarks is not None:
+        lower, upper = landmarks.bounds(source, target)
+        if lower == math.inf:
             return None
+        if upper == lower:
+            forward_estimate = landmarks.heuristic(target)
+            backward_estimate = landmarks.heuristic(source)
+
+    # Map each reached person to the (movie, person) they were reached from,
+    # and each reached movie to the person it was reached from
+    forward, forward_movies = {source: None}, {}
+    backward, backward_movies = {target: None}, {}
+    forward_frontier = [source]
+    backward_frontier = [target]
+    forward_depth = backward_depth = 0
+
+    # Keep looping until the two searches meet
+    while forward_frontier and backward_frontier:
+
+        # Grow whichever side has fewer people waiting to be expanded
+        if len(forward_frontier) <= len(backward_frontier):
+            forward_frontier, meeting = expand_level(
+                forward_frontier, forward, forward_movies,
+                backward, backward_movies,
+                forward_estimate, upper - forward_depth
+            )
+            forward_depth += 1
+        else:
+            backward_frontier, meeting = expand_level(
+                backward_frontier, backward, backward_movies,
+                forward, forward_movies,
+                backward_estimate, upper - backward_depth
+            )
+            backward_depth += 1
+
+        if meeting is not None:
+            return join_paths(meeting, forward, backward)
+
+    # One side ran out of people to expand, so no path
+    return None
+
+
+def expand_level(frontier, parents, movie_parents,
+                 other_parents, other_movie_parents,
+                 estimate=None, budget=math.inf):
+    """
+    Expands every person in `frontier` by one step: first to the movies
+    they starred in that this search has not reached yet, then to the
+    casts of those movies. Newly reached people and movies are recorded
+    in `parents` and `movie_parents`.
 
-        # Choose a node from the frontier
-        node = frontier.remove()
+    If `estimate` is given, people in `frontier` it places more than
+    `budget` degrees from the other end are left unexpanded, since no
+    shortest path runs through them.
 
-        # Mark node as explored
-        explored.add(node.state)
+    Returns the next frontier and the first person also reached by the
+    other search, or None if the searches have not met yet.
+    """
+    movies_of = graph.movies_of
+    stars_of = graph.stars_of
+
+    # Only pay for the estimates of people about to be expanded
+    if estimate is not None:
+        frontier = [p for p in frontier if estimate(p) <= budget]
+
+    # Reach the movies, stopping early if the other search already has one.
+    # Every meeting found at this step joins into a path of the same length,
+    # which is shorter than any meeting found among the casts below.
+    new_movies = []
+    for p in frontier:
+        for m in movies_of(p):
+            if m in movie_parents:
+                continue
+            movie_parents[m] = p
+            if m in other_movie_parents:
+                # Step straight through the shared movie to the other side
+                neighbor = other_movie_parents[m]
+                parents[neighbor] = (m, p)
+                return [], neighbor
+            new_movies.append(m)
+
+    # Reach the casts of the new movies, scanning each cast only once
+    next_frontier = []
+    for m in new_movies:
+        p = movie_parents[m]
+        for neighbor in stars_of(m):
+            if neighbor in parents:
+                continue
+            parents[neighbor] = (m, p)
+            if neighbor in other_parents:
+                return next_frontier, neighbor
+            next_frontier.append(neighbor)
+    return next_frontier, None
+
+
+def join_paths(meeting, forward, backward):
+    """
+    Returns the (movie, person) pairs from the source to the target
+    passing through `meeting`, the person where both searches met.
+    """
+    list_of_pairs = []
+
+    # Walk back from the meeting person to the source
+    p = meeting
+    while forward[p] is not None:
+        m, parent = forward[p]
+        list_of_pairs.append((m, p))
+        p = parent
+    list_of_pairs.reverse()
 
-        # Add neighbors to frontier
-        for action, state in neighbors_for_person(node.state):
-            if not frontier.contains_state(state) and state not in explored:
-                child = Node(state=state, parent=node, action=action)
+    # Walk forward from the meeting person to the target
+    p = meeting
+    while backward[p] is not None:
+        m, following = backward[p]
+        list_of_pairs.append((m, following))
+        p = following
 
-                # If child is the goal, then we have a solution
-                if child.state == target:
-                    while child.parent is not None:
-                        list_of_pairs = [(child.action, child.state)] + list_of_pairs
-                        child = child.parent
-                    return list_of_pairs
-                frontier.add(child)
+    return list_of_pairs
 
 
 def person_id_for_name(name):
     """
     Returns the IMDB id for a person's name,
     resolving ambiguities as needed.
+
+    If nobody has exactly that name, the closest matching names are
+    offered instead.
     """
-    person_ids = list(names.get(name.lower(), set()))
+    person_ids = [graph.person_ids[p] for p in graph.people_named(name)]
     if len(person_ids) == 0:
+        person_ids = [graph.person_ids[p] for p, _, _ in find_people(name)]
+        if len(person_ids) == 0:
+            return None
+        print(f"No exact match for '{name}'. Did you mean:")
+        for person_id in person_ids:
+            person = graph.person(person_id)
+            print(f"ID: {person_id}, Name: {person['name']}, Birth: {person['birth']}")
+        try:
+            person_id = input("Intended Person ID: ")
+            if person_id in person_ids:
+                return person_id
+        except ValueError:
+            pass
         return None
     elif len(person_ids) > 1:
         print(f"Which '{name}'?")
         for person_id in person_ids:
-            person = people[person_id]
+            person = graph.person(person_id)
             name = person["name"]
             birth = person["birth"]
             print(f"ID: {person_id}, Name: {name}, Birth: {birth}")
@@ -160,13 +1702,12 @@ def neighbors_for_person(person_id):
     Returns (movie_id, person_id) pairs for people
     who starred with a given person.
     """
-    movie_ids = people[person_id]["movies"]
     neighbors = set()
-    for movie_id in movie_ids:
-        for person_id in movies[movie_id]["stars"]:
-            neighbors.add((movie_id, person_id))
+    for m in graph.movies_of(graph.person_index(person_id)):
+        for p in graph.stars_of(m):
+            neighbors.add((graph.movie_ids[m], graph.person_ids[p]))
     return neighbors
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,42 +1,191 @@
+import argparse
+import json
+import multiprocessing
 import os
 import random
 import re
+import struct
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve_triangular
 
 DAMPING = 0.85
 SAMPLES = 10000
 
+# Iteration stops once one more step would change the ranks by less
+# than TOLERANCE in total, using one of SOLVERS. The extrapolating
+# solvers extrapolate every EXTRAPOLATION_INTERVAL steps.
+TOLERANCE = 0.001
+SOLVERS = ("jacobi", "gauss-seidel", "aitken", "quadratic")
+EXTRAPOLATION_INTERVAL = 10
+
+# Parallel sampling stops once every page's confidence interval is this
+# narrow, drawing BATCH_SAMPLES per chain at a time, with at least
+# MIN_BATCHES batches for a stable interval and never more than
+# MAX_SAMPLES samples in total
+TARGET_ERROR = 0.005
+BATCH_SAMPLES = 10000
+MIN_BATCHES = 16
+MAX_SAMPLES = 10 ** 8
+CONFIDENCE_Z = 1.96
+
+# Links of the corpus being sampled, set in each parallel sampling worker
+worker_links = None
+
+# Links found in each page are cached in this file in the corpus directory
+CRAWL_CACHE = ".pagerank-links.json"
+CRAWL_CACHE_VERSION = 1
+
+# Pages are read this many characters at a time, and parsed in parallel
+# only when at least PARALLEL_PAGES of them need parsing
+CHUNK_SIZE = 1 << 16
+PARALLEL_PAGES = 64
+
+# Out-of-core ranking reads links from this binary edge list in the
+# corpus directory: a header of magic, page count and edge count, then
+# (source, target) page indices sorted by source. Page names are kept
+# one per line in a file with EDGE_PAGES_SUFFIX added to its name.
+# Edges are read EDGE_BLOCK at a time.
+EDGE_LIST = ".pagerank-edges"
+EDGE_PAGES_SUFFIX = ".pages"
+EDGE_MAGIC = b"PREDGES1"
+EDGE_HEADER = struct.Struct("<8sQQ")
+EDGE_DTYPE = np.dtype([("source", "<u4"), ("target", "<u4")])
+EDGE_BLOCK = 1 << 22
+
+# Forward push for a single seed stops once every page's residual rank
+# is below this times its number of links
+PUSH_EPSILON = 1e-6
+
+# Incremental updates give up pushing residual after this many pushes
+# per page, and iterate instead. A push costs about as much as a sparse
+# step over a thousand pages, and a warm-started iteration takes about
+# ten steps.
+PUSH_BUDGET = 0.01
+
+LINK_PATTERN = re.compile(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"")
+
 
 def main():
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python pagerank.py corpus")
-    corpus = crawl(sys.argv[1])
-    ranks = sample_pagerank(corpus, DAMPING, SAMPLES)
-    print(f"PageRank Results from Sampling (n = {SAMPLES})")
-    for page in sorted(ranks):
-        print(f"  {page}: {ranks[page]:.4f}")
-    ranks = iterate_pagerank(corpus, DAMPING)
+    parser = argparse.ArgumentParser(description="Rank the pages of a corpus.")
+    parser.add_argument("corpus")
+    parser.add_argument(
+        "--target-error", type=float,
+        help="sample in parallel until every page's 95%% confidence "
+             "interval is within this of its estimate"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="number of processes crawling, and sampling with --target-error"
+    )
+    parser.add_argument(
+        "--solver", choices=SOLVERS, default="jacobi",
+        help="method used to iterate PageRank"
+    )
+    parser.add_argument(
+        "--trace", action="store_true",
+        help="report the residual and elapsed time of every iteration"
+    )
+    parser.add_argument(
+        "--seed", action="append", default=[],
+        help="also rank pages by personalized PageRank, teleporting only "
+             "to this page; several seeds are solved together"
+    )
+    parser.add_argument(
+        "--push", action="store_true",
+        help="approximate personalized PageRank by forward push from each "
+             "seed, touching only the pages near it"
+    )
+    parser.add_argument(
+        "--check-update", type=int, metavar="CHANGES",
+        help="add and remove this many random links, update the ranks "
+             "locally, and report how far they are from a full recompute"
+    )
+    parser.add_argument(
+        "--out-of-core", action="store_true",
+        help="write the links to an edge list in the corpus directory, "
+             "reusing the crawl cache, and rank by iteration over it "
+             "without building the link matrix in memory"
+    )
+    args = parser.parse_args()
+    callback = report_iteration if args.trace else None
+
+    if args.out_of_core:
+        path = write_edge_list(args.corpus, workers=args.workers)
+        ranks = stream_pagerank(path, DAMPING, callback=callback)
+        print(f"PageRank Results from Iteration")
+        for page, rank in zip(read_edge_pages(path), ranks.tolist()):
+            print(f"  {page}: {rank:.4f}")
+        return
+
+    corpus = crawl(args.corpus, args.workers)
+    for seed in args.seed:
+        if seed not in corpus:
+            parser.error(f"seed {seed} is not a page of the corpus")
+    if args.target_error is not None:
+        ranks, errors, samples = parallel_sample_pagerank(
+            corpus, DAMPING, args.target_error, args.workers
+        )
+        print(f"PageRank Results from Parallel Sampling (n = {samples})")
+        for page in sorted(ranks):
+            print(f"  {page}: {ranks[page]:.4f} ± {errors[page]:.4f}")
+    else:
+        ranks = sample_pagerank(corpus, DAMPING, SAMPLES)
+        print(f"PageRank Results from Sampling (n = {SAMPLES})")
+        for page in sorted(ranks):
+            print(f"  {page}: {ranks[page]:.4f}")
+    ranks = iterate_pagerank(
+        corpus, DAMPING, solver=args.solver, callback=callback
+    )
     print(f"PageRank Results from Iteration")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
+    if args.check_update:
+        difference = check_update(corpus, ranks, DAMPING, args.check_update)
+        print(f"Local update is {difference:.6f} from a full recompute "
+              f"(tolerance {TOLERANCE})")
+
+    if args.push:
+        results = [forward_push(corpus, seed, DAMPING) for seed in args.seed]
+    elif args.seed:
+        results = personalized_pagerank(
+            corpus, [{seed: 1} for seed in args.seed], DAMPING, callback=callback
+        )
+    else:
+        results = []
+    for seed, ranks in zip(args.seed, results):
+        print(f"Personalized PageRank Results for {seed}")
+        for page in sorted(ranks):
+            print(f"  {page}: {ranks[page]:.4f}")
+
+
+def report_iteration(iteration, residual, elapsed):
+    """
+    Print the progress of an iteration to standard error.
+    """
+    print(
+        f"  iteration {iteration}: residual {residual:.3e} after {elapsed:.3f}s",
+        file=sys.stderr
+    )
 
 
-def crawl(directory):
+def crawl(directory, workers=None, cache=True):
     """
     Parse a directory of HTML pages and check for links to other pages.
     Return a dictionary where each key is a page, and values are
     a list of all other pages in the corpus that are linked to by the page.
-    """
-    pages = dict()
 
-    # Extract all links from HTML files
-    for filename in os.listdir(directory):
-        if not filename.endswith(".html"):
-            continue
-        with open(os.path.join(directory, filename)) as f:
-            contents = f.read()
-            links = re.findall(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"", contents)
-            pages[filename] = set(links) - {filename}
+    Pages are parsed on up to `workers` processes. Unless `cache` is
+    False, the links of every page are saved in CRAWL_CACHE alongside
+    its modification time and size, and pages unchanged since the last
+    crawl are not parsed again.
+    """
+    pages = dict(crawl_pages(directory, scan_pages(directory), workers, cache))
 
     # Only include links to other pages in the corpus
     for filename in pages:
@@ -48,6 +197,197 @@ def crawl(directory):
     return pages
 
 
+def scan_pages(directory):
+    """
+    Return the [mtime, size] of each HTML page in a directory.
+    """
+    keys = dict()
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if not entry.name.endswith(".html") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            keys[entry.name] = [stat.st_mtime_ns, stat.st_size]
+    return keys
+
+
+def crawl_pages(directory, keys, workers=None, cache=True):
+    """
+    Yield each page of a directory found by scan_pages, given as `keys`,
+    in sorted order with the set of link targets in it other than itself,
+    as crawl finds them: pages are parsed on up to `workers` processes,
+    and unless `cache` is False, pages unchanged since the last crawl
+    are not parsed again. The cache is saved once every page has been
+    yielded.
+    """
+    cache_path = os.path.join(directory, CRAWL_CACHE)
+    cached = read_crawl_cache(cache_path) if cache else {}
+
+    # Reuse the links of unchanged pages, and find the rest
+    pages = sorted(keys)
+    changed = [
+        filename for filename in pages
+        if filename not in cached or cached[filename][:2] != keys[filename]
+    ]
+
+    # Extract all links from new and changed HTML files as they come up
+    parsed = parse_pages(
+        [os.path.join(directory, filename) for filename in changed], workers
+    )
+    changed = set(changed)
+    entries = dict()
+    for filename in pages:
+        if filename in changed:
+            links = next(parsed) - {filename}
+            if cache:
+                entries[filename] = keys[filename] + [sorted(links)]
+        else:
+            links = set(cached[filename][2])
+            entries[filename] = cached[filename]
+        yield filename, links
+
+    if cache and (changed or len(entries) != len(cached)):
+        write_crawl_cache(cache_path, entries)
+
+
+def parse_pages(paths, workers=None):
+    """
+    Yield the set of link targets in each HTML file of `paths`, in
+    order, parsing on up to `workers` processes when there are at least
+    PARALLEL_PAGES files.
+    """
+    if len(paths) < PARALLEL_PAGES or workers == 1:
+        yield from map(extract_links, paths)
+        return
+    chunksize = max(1, len(paths) // (4 * (workers or os.cpu_count())))
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(extract_links, paths, chunksize=chunksize)
+
+
+def extract_links(path):
+    """
+    Return the set of link targets in the HTML file at `path`, reading
+    it CHUNK_SIZE characters at a time rather than all at once.
+    """
+    links = set()
+    with open(path) as f:
+        carry = ""
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            text = carry + chunk
+            links.update(LINK_PATTERN.findall(text))
+
+            # Keep a tag cut off by the end of the chunk for the next one
+            start = text.rfind("<")
+            carry = text[start:] if start != -1 and ">" not in text[start:] else ""
+    return links
+
+
+def read_crawl_cache(path):
+    """
+    Return the cached [mtime, size, links] of each page, or an empty
+    dictionary if there is no usable cache at `path`.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != CRAWL_CACHE_VERSION:
+        return {}
+    return cache.get("pages", {})
+
+
+def write_crawl_cache(path, entries):
+    """
+    Save the [mtime, size, links] of each page to the cache at `path`.
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"version": CRAWL_CACHE_VERSION, "pages": entries}, f)
+        os.replace(temporary, path)
+    except OSError:
+        # A read-only corpus just means nothing is cached
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_edge_list(directory, path=None, workers=None, cache=True):
+    """
+    Parse a directory of HTML pages like crawl, but write the links
+    between its pages to a binary edge list at `path`, EDGE_LIST in the
+    directory by default, rather than returning them. Return the path.
+
+    Pages are numbered in sorted order and found as crawl_pages finds
+    them, reusing and updating the crawl cache unless `cache` is False,
+    and edges are written page by page. Without the cache, only the
+    page names are held in memory.
+    """
+    path = path or os.path.join(directory, EDGE_LIST)
+    keys = scan_pages(directory)
+    pages = sorted(keys)
+    index = {page: i for i, page in enumerate(pages)}
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary + EDGE_PAGES_SUFFIX, "w", encoding="utf-8") as f:
+            f.writelines(page + "\n" for page in pages)
+
+        edges = 0
+        with open(temporary, "wb") as f:
+            f.write(EDGE_HEADER.pack(EDGE_MAGIC, len(pages), 0))
+            pending = []
+            for page, links in crawl_pages(directory, keys, workers, cache):
+                source = index[page]
+                targets = sorted(index[link] for link in links if link in index)
+                for target in targets:
+                    pending += (source, target)
+                edges += len(targets)
+                if len(pending) >= 2 * EDGE_BLOCK:
+                    np.array(pending, dtype="<u4").tofile(f)
+                    pending = []
+            np.array(pending, dtype="<u4").tofile(f)
+
+            # The edge count is only known once every page is parsed
+            f.seek(0)
+            f.write(EDGE_HEADER.pack(EDGE_MAGIC, len(pages), edges))
+
+        os.replace(temporary + EDGE_PAGES_SUFFIX, path + EDGE_PAGES_SUFFIX)
+        os.replace(temporary, path)
+    finally:
+        for leftover in (temporary + EDGE_PAGES_SUFFIX, temporary):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return path
+
+
+def read_edge_list(path):
+    """
+    Return the number of pages in the edge list at `path`, and its
+    edges memory-mapped as an array of (source, target) pairs.
+    """
+    with open(path, "rb") as f:
+        magic, count, edges = EDGE_HEADER.unpack(f.read(EDGE_HEADER.size))
+    if magic != EDGE_MAGIC:
+        raise ValueError(f"{path} is not a PageRank edge list")
+    if edges == 0:
+        return count, np.empty(0, dtype=EDGE_DTYPE)
+    return count, np.memmap(
+        path, dtype=EDGE_DTYPE, mode="r", offset=EDGE_HEADER.size, shape=(edges,)
+    )
+
+
+def read_edge_pages(path):
+    """
+    Return the names of the pages in the edge list at `path`, in order.
+    """
+    with open(path + EDGE_PAGES_SUFFIX, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
 def transition_model(corpus, page, damping_factor):
     """
     Return a probability distribution over which page to visit next,
@@ -92,31 +432,139 @@ def sample_pagerank(corpus, damping_factor, n):
     Return a dictionary where keys are page names, and values are
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
+
+    Rather than building the full distribution from transition_model at
+    every step, each step draws in two stages: with probability
+    `damping_factor` it follows one of the current page's links chosen
+    uniformly, and otherwise it jumps to any page chosen uniformly.
+    That gives the same distribution in constant time per sample.
     """
-    page_rank = dict()
-    sample_list = []
-    pages = list(corpus.keys())
-    sample = None
+    pages, links = link_indices(corpus)
+    counts, _ = random_walk(links, damping_factor, n, random.random)
+    return {page: count / n for page, count in zip(pages, counts)}
 
-    for i in range(n):
 
-        if sample is None:
-            sample = random.choice(pages)
-            sample_list.append(sample)
+def random_walk(links, damping_factor, n, draw, sample=None):
+    """
+    Return how often each page is visited in `n` steps of a random walk
+    over `links`, and the page the walk ends on.
+
+    The walk continues from page `sample`, or starts from a page chosen
+    at random (counted as the first visit) when `sample` is None.
+    `draw` returns random floats in [0, 1).
+    """
+    total = len(links)
+    counts = [0] * total
+    steps = n
+    if sample is None:
+        sample = int(draw() * total)
+        counts[sample] += 1
+        steps -= 1
+
+    for _ in range(steps):
+        outgoing = links[sample]
+        if outgoing and draw() < damping_factor:
+            sample = outgoing[int(draw() * len(outgoing))]
         else:
-            page_sequence = list(transition_model(corpus, sample, damping_factor).keys())
-            page_weights = list(transition_model(corpus, sample, damping_factor).values())
-            sample = random.choices(population=page_sequence, weights=page_weights, k=1)[0]
-            sample_list.append(sample)
+            sample = int(draw() * total)
+        counts[sample] += 1
+
+    return counts, sample
+
+
+def parallel_sample_pagerank(corpus, damping_factor, target_error=TARGET_ERROR,
+                             workers=None, seed=None):
+    """
+    Return PageRank estimates from independent random walks run on
+    `workers` processes, along with the half-width of each page's 95%
+    confidence interval and the number of samples drawn.
+
+    Every chain has its own seed, derived from `seed`, and draws
+    BATCH_SAMPLES at a time. Each batch of each chain is one estimate
+    of the ranks; the spread of those estimates (batch means) gives the
+    confidence intervals. Sampling stops once every interval is within
+    `target_error`, after at least MIN_BATCHES batches, or after
+    MAX_SAMPLES samples.
+    """
+    pages, links = link_indices(corpus)
+    workers = workers or os.cpu_count()
+    chains = max(2, workers)
+    seeds = np.random.SeedSequence(seed).generate_state(chains, dtype=np.uint64)
+    states = [random.Random(int(s)).getstate() for s in seeds]
+    positions = [None] * chains
+
+    counts = np.zeros(len(pages))
+    squares = np.zeros(len(pages))
+    batches = 0
+    with multiprocessing.Pool(
+        workers, initializer=init_sampler, initargs=(links,)
+    ) as pool:
+        while True:
+            results = pool.map(sample_chain, [
+                (states[c], positions[c], damping_factor) for c in range(chains)
+            ])
+            for c, (batch, position, state) in enumerate(results):
+                batch = np.array(batch)
+                counts += batch
+                squares += (batch / BATCH_SAMPLES) ** 2
+                positions[c] = position
+                states[c] = state
+            batches += chains
+
+            # Spread of the batch estimates around their mean
+            ranks = counts / (batches * BATCH_SAMPLES)
+            variance = np.maximum(squares / batches - ranks ** 2, 0)
+            variance *= batches / (batches - 1)
+            errors = CONFIDENCE_Z * np.sqrt(variance / batches)
+            if batches >= MIN_BATCHES and errors.max() <= target_error or \
+                    batches * BATCH_SAMPLES >= MAX_SAMPLES:
+                break
+
+    return (
+        dict(zip(pages, ranks.tolist())),
+        dict(zip(pages, errors.tolist())),
+        batches * BATCH_SAMPLES
+    )
+
 
-    for key in corpus:
-        count = sample_list.count(key)
-        page_rank[key] = count / n
+def init_sampler(links):
+    """
+    Keep the corpus links in a parallel sampling worker.
+    """
+    global worker_links
+    worker_links = links
 
-    return page_rank
 
+def sample_chain(task):
+    """
+    Continue one random-walk chain by BATCH_SAMPLES steps in a worker.
+    Return the visit counts, the page it ends on and its random state.
+    """
+    state, position, damping_factor = task
+    generator = random.Random()
+    generator.setstate(state)
+    counts, position = random_walk(
+        worker_links, damping_factor, BATCH_SAMPLES, generator.random, position
+    )
+    return counts, position, generator.getstate()
 
-def iterate_pagerank(corpus, damping_factor):
+
+def link_indices(corpus):
+    """
+    Return the pages of `corpus` in sorted order, and for each page
+    a tuple of the indices of the pages it links to.
+    """
+    pages = sorted(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+    links = [
+        tuple(index[link] for link in corpus[page] if link in index)
+        for page in pages
+    ]
+    return pages, links
+
+
+def iterate_pagerank(corpus, damping_factor, tolerance=TOLERANCE,
+                     solver="jacobi", callback=None):
     """
     Return PageRank values for each page by iteratively updating
     PageRank values until convergence.
@@ -124,36 +572,592 @@ def iterate_pagerank(corpus, damping_factor):
     Return a dictionary where keys are page names, and values are
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
+
+    Iteration stops once the residual, the total change in PageRank
+    values one more update would make, is below `tolerance`. `solver`
+    is one of SOLVERS, and `callback`, if given, is called after every
+    iteration with its number, its residual and the seconds elapsed.
+    `corpus` is left unchanged.
     """
-    PR = dict()
-    links = set()
-    for page in corpus:
-        if len(corpus[page]) == 0:
-            for add_link in corpus:
-               links.add(add_link)
-            corpus[page] = links
+    pages, matrix, dangling = transition_matrix(corpus)
+    if solver == "jacobi":
+        ranks = power_iteration(
+            matrix, dangling, damping_factor, tolerance, callback=callback
+        )
+    elif solver == "gauss-seidel":
+        ranks = gauss_seidel(
+            matrix, dangling, damping_factor, tolerance, callback=callback
+        )
+    elif solver in ("aitken", "quadratic"):
+        ranks = power_iteration(
+            matrix, dangling, damping_factor, tolerance,
+            extrapolation=solver, callback=callback
+        )
+    else:
+        raise ValueError(f"unknown solver {solver!r}")
+    return dict(zip(pages, ranks.tolist()))
+
+
+def stream_pagerank(path, damping_factor, tolerance=TOLERANCE, callback=None):
+    """
+    Return PageRank values, as an array in page order, for the edge list
+    at `path` as written by write_edge_list.
+
+    Iterates like power_iteration, reporting to `callback` the same way,
+    but reads the memory-mapped edges
+    EDGE_BLOCK at a time on every step, so only a few arrays with one
+    value per page are held in memory however many links there are.
+    """
+    n, edges = read_edge_list(path)
+    if n == 0:
+        return np.empty(0)
 
-    for p in corpus:
-        PR[p] = 1 / len(corpus)
+    # Edges are sorted by source, so each block covers a run of sources
+    degree = np.zeros(n)
+    for start in range(0, len(edges), EDGE_BLOCK):
+        sources = edges["source"][start:start + EDGE_BLOCK]
+        first = sources[0]
+        counts = np.bincount(sources - first)
+        degree[first:first + len(counts)] += counts
+    dangling = degree == 0
+    degree[dangling] = 1
 
+    ranks = np.full(n, 1 / n)
+    started = time.perf_counter()
+    iteration = 0
     while True:
-        counter = 0
-        current = PR.copy()
-        for p in corpus:
-            recursive_value = 0
-            for link in corpus:
-                if p in corpus[link]:
-                    recursive_value += current[link] / len(corpus[link])
-
-            value = (1 - damping_factor) / len(corpus)
-            PR[p] = value + damping_factor * recursive_value
-            if abs(current[p] - PR[p]) < 0.001:
-                counter += 1
-
-        if counter == len(corpus):
-            break
-
-    return current
+        share = damping_factor * ranks / degree
+        spread = damping_factor * ranks[dangling].sum() / n
+        updated = np.full(n, spread + (1 - damping_factor) / n)
+        for start in range(0, len(edges), EDGE_BLOCK):
+            block = edges[start:start + EDGE_BLOCK]
+            np.add.at(updated, block["target"], share[block["source"]])
+
+        iteration += 1
+        residual = np.abs(updated - ranks).sum()
+        if callback is not None:
+            callback(iteration, residual, time.perf_counter() - started)
+        if residual < tolerance:
+            return updated
+        ranks = updated
+
+
+def update_pagerank(corpus, ranks, damping_factor, added=(), removed=(),
+                    removed_pages=(), tolerance=TOLERANCE, model=None):
+    """
+    Return the corpus after a change to its links, its PageRank values,
+    and its transition model, as a (corpus, ranks, model) triple.
+    `corpus` is left unchanged.
+
+    `ranks` are the PageRank values of `corpus` before the change, and
+    `added`, `removed` and `removed_pages` describe the change as for
+    apply_link_delta. `model` is the (pages, matrix, dangling) triple of
+    `corpus` as returned by transition_matrix, or by an earlier update;
+    it is patched where the links changed rather than rebuilt, and built
+    from scratch only if not given.
+
+    PageRank is proportional to the solution y of y = 1 + d * M y, where
+    M follows links only and rank on pages without links simply drops
+    out; normalizing y restores it. Starting from the previous values,
+    only pages near the change leave a noticeable residual in that
+    equation, so it is settled by pushing residual along links from
+    those pages alone. If the pushes spread to more than PUSH_BUDGET
+    times the number of pages, the update falls back to power iteration
+    warm-started from the previous values. Either way the result is
+    within half of `tolerance` of the exact values, leaving the other
+    half for the error of a full recompute.
+    """
+    if model is None:
+        model = transition_matrix(corpus)
+    pages, matrix, dangling = model
+    previous = np.array([ranks.get(page, 0.0) for page in pages])
+    # Exact PageRank is y times the rank every page gets by jumping
+    scale = (1 - damping_factor + damping_factor * previous[dangling].sum()) \
+        / max(len(pages), 1)
+
+    updated = apply_link_delta(corpus, added, removed, removed_pages)
+    pages, matrix, dangling, index, kept = update_transition_matrix(
+        model, updated, added, removed, removed_pages
+    )
+    y = np.ones(len(pages))
+    y[:len(kept)] = previous[kept] / scale
+    residual = 1 - y + damping_factor * (matrix @ y)
+
+    def links_of(i):
+        return [index[link] for link in updated[pages[i]] if link in index]
+
+    # y is off by at most the total residual / (1 - d), and normalizing
+    # at most doubles that
+    target = (1 - damping_factor) * tolerance * y.sum() / 4
+    if push_residual(links_of, damping_factor, y, residual, target,
+                     PUSH_BUDGET * len(pages)):
+        result = y / y.sum()
+    else:
+        # Iteration stopped at residual r is off by at most d * r / (1 - d)
+        result = power_iteration(
+            matrix, dangling, damping_factor, (1 - damping_factor) * tolerance / 2,
+            y / y.sum()
+        )
+    return updated, dict(zip(pages, result.tolist())), (pages, matrix, dangling)
+
+
+def update_transition_matrix(model, updated, added=(), removed=(),
+                             removed_pages=()):
+    """
+    Return the transition_matrix triple of `updated`, the corpus `model`
+    was built from after the change described as for apply_link_delta,
+    then a dictionary of each page's position, and the positions in the
+    old model of the pages kept.
+
+    Only the columns of pages whose links changed are rebuilt from
+    `updated`; the rest of the matrix is kept. Pages that were not in
+    the model follow the ones that were, in sorted order.
+    """
+    pages, matrix, dangling = model
+    index = {page: i for i, page in enumerate(pages)}
+    gone = np.array(
+        sorted(index[page] for page in set(removed_pages) if page in index),
+        dtype=np.int64
+    )
+
+    # Pages whose links changed, including every page linking to a
+    # removed one, which row `gone` of the matrix lists
+    changed = {page for page, _ in added} | {page for page, _ in removed}
+    columns = np.zeros(len(pages), dtype=bool)
+    columns[[index[page] for page in changed if page in index]] = True
+    columns[matrix[gone].indices] = True
+    columns[gone] = True
+
+    fresh = sorted(
+        {page for pair in added for page in pair if page not in index}
+        & updated.keys()
+    )
+    n = len(pages) + len(fresh)
+    pages = pages + fresh
+    index.update((page, i) for i, page in enumerate(fresh, len(index)))
+
+    sources = []
+    targets = []
+    for i in np.flatnonzero(columns).tolist() + list(range(len(columns), n)):
+        if pages[i] not in updated:
+            continue
+        links = [index[link] for link in updated[pages[i]] if link in index]
+        sources.extend([i] * len(links))
+        targets.extend(links)
+    sources = np.array(sources, dtype=np.int64)
+    out_degree = np.bincount(sources, minlength=n)
+
+    kept = matrix.copy()
+    kept.data[columns[kept.indices]] = 0
+    kept.eliminate_zeros()
+    kept.resize((n, n))
+    matrix = (kept + sparse.csr_matrix(
+        (1 / out_degree[sources], (np.array(targets, dtype=np.int64), sources)),
+        shape=(n, n)
+    )).tocsr()
+
+    alive = np.ones(n, dtype=bool)
+    alive[gone] = False
+    if len(gone):
+        matrix = matrix[alive][:, alive]
+        pages = [page for page, keep in zip(pages, alive.tolist()) if keep]
+        index = {page: i for i, page in enumerate(pages)}
+    dangling = np.bincount(matrix.indices, minlength=len(pages)) == 0
+    return pages, matrix, dangling, index, np.flatnonzero(alive[:len(columns)])
+
+
+def push_residual(links_of, damping_factor, y, residual, target, budget):
+    """
+    Settle y = 1 + d * M y in place by repeatedly moving the residual of
+    a page into `y` and passing a damped share of it to each page it
+    links to, as listed by `links_of`, until the residuals add up to no
+    more than `target`.
+
+    Larger residuals are pushed first: each round pushes every residual
+    above a threshold, which halves from round to round. Return False,
+    leaving `y` partly settled, if that takes more than `budget` pushes.
+    """
+    pushes = 0
+    total = np.abs(residual).sum()
+    threshold = np.abs(residual).max(initial=0) / 2
+    while total > target:
+        queue = deque(np.flatnonzero(np.abs(residual) > threshold).tolist())
+        queued = set(queue)
+        while queue:
+            page = queue.popleft()
+            queued.discard(page)
+            amount = residual[page]
+            if abs(amount) <= threshold:
+                continue
+
+            pushes += 1
+            if pushes > budget:
+                return False
+            y[page] += amount
+            residual[page] = 0
+            total -= abs(amount)
+
+            links = links_of(page)
+            if len(links):
+                before = np.abs(residual[links]).sum()
+                residual[links] += damping_factor * amount / len(links)
+                after = np.abs(residual[links])
+                total += after.sum() - before
+                for link, size in zip(links, after.tolist()):
+                    if size > threshold and link not in queued:
+                        queued.add(link)
+                        queue.append(link)
+            if total <= target:
+                return True
+
+        # Recount to keep rounding in the running total from building up
+        total = np.abs(residual).sum()
+        threshold /= 2
+    return True
+
+
+def check_update(corpus, ranks, damping_factor, changes, tolerance=TOLERANCE):
+    """
+    Return the total difference between the PageRank values found by
+    update_pagerank, after `changes` random links are added to `corpus`
+    and as many removed, and those found by iterating from scratch.
+    """
+    generator = random.Random(0)
+    pages = sorted(corpus)
+    added = [
+        (generator.choice(pages), generator.choice(pages)) for _ in range(changes)
+    ]
+    linking = [page for page in pages if corpus[page]]
+    removed = [
+        (page, generator.choice(sorted(corpus[page])))
+        for page in generator.sample(linking, min(changes, len(linking)))
+    ]
+    updated, updated_ranks, _ = update_pagerank(
+        corpus, ranks, damping_factor, added, removed, tolerance=tolerance
+    )
+    full = iterate_pagerank(updated, damping_factor, tolerance)
+    return sum(abs(updated_ranks[page] - full[page]) for page in full)
+
+
+def apply_link_delta(corpus, added=(), removed=(), removed_pages=()):
+    """
+    Return a copy of `corpus` with the `added` (page, link) pairs added,
+    the `removed` ones removed, and each of `removed_pages` dropped along
+    with every link to it. Pages first seen in `added` join the corpus.
+    """
+    # Share the link sets of untouched pages with `corpus`, copying
+    # each set only before it changes
+    updated = dict(corpus)
+    copied = set()
+
+    def links_of(page):
+        if page not in copied:
+            updated[page] = set(updated.get(page, ()))
+            copied.add(page)
+        return updated[page]
+
+    for page, link in added:
+        links = links_of(page)
+        links_of(link)
+        if page != link:
+            links.add(link)
+    for page, link in removed:
+        if page in updated and link in updated[page]:
+            links_of(page).discard(link)
+
+    removed_pages = set(removed_pages)
+    for page in removed_pages:
+        updated.pop(page, None)
+    if removed_pages:
+        for page in list(updated):
+            if not removed_pages.isdisjoint(updated[page]):
+                links_of(page).difference_update(removed_pages)
+    return updated
+
+
+def personalized_pagerank(corpus, teleports, damping_factor, tolerance=TOLERANCE,
+                          callback=None):
+    """
+    Return personalized PageRank values for each of `teleports`, as a
+    list of dictionaries like those of iterate_pagerank.
+
+    Each teleport is a dictionary giving pages of `corpus` a weight;
+    instead of jumping to any page, the random surfer jumps to one of
+    them in proportion to its weight, including when on a page with no
+    links. All the teleports are solved together, as the columns of one
+    matrix, over a single transition matrix. Iteration stops once every
+    column's residual is below `tolerance`, calling `callback` as for
+    iterate_pagerank with the largest of them.
+    """
+    pages, matrix, dangling = transition_matrix(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+
+    jumps = np.zeros((len(pages), len(teleports)))
+    for column, teleport in enumerate(teleports):
+        for page, weight in teleport.items():
+            if page not in index:
+                raise ValueError(f"{page!r} is not in the corpus")
+            jumps[index[page], column] += weight
+        total = jumps[:, column].sum()
+        if total <= 0:
+            raise ValueError("teleport weights must have a positive total")
+        jumps[:, column] /= total
+
+    ranks = personalized_iteration(
+        matrix, dangling, damping_factor, jumps, tolerance, callback
+    )
+    return [dict(zip(pages, column.tolist())) for column in ranks.T]
+
+
+def forward_push(corpus, seed, damping_factor, epsilon=PUSH_EPSILON):
+    """
+    Return approximate personalized PageRank values for teleporting
+    only to `seed`, as a dictionary of the pages that got any rank.
+
+    Rank starts as residual on `seed`. Pushing a page keeps
+    1 - `damping_factor` of its residual as rank and passes the rest
+    along its links, or back to `seed` if it has none. Only pages whose
+    residual reaches `epsilon` times their number of links are pushed,
+    so only the neighbourhood of `seed` is visited. Rank still left as
+    residual is not assigned, so the values sum to slightly under 1.
+    """
+    if seed not in corpus:
+        raise ValueError(f"{seed!r} is not in the corpus")
+
+    ranks = dict()
+    residual = {seed: 1.0}
+    queue = deque([seed])
+    while queue:
+        page = queue.popleft()
+        links = corpus[page]
+        amount = residual[page]
+        if amount < epsilon * max(1, len(links)):
+            continue
+
+        ranks[page] = ranks.get(page, 0) + (1 - damping_factor) * amount
+        residual[page] = 0
+        targets = links if links else (seed,)
+        share = damping_factor * amount / len(targets)
+        for link in targets:
+            before = residual.get(link, 0)
+            residual[link] = before + share
+            # Queue a page once, when its residual first crosses the bar
+            bar = epsilon * max(1, len(corpus[link]))
+            if before < bar <= residual[link]:
+                queue.append(link)
+    return ranks
+
+
+def transition_matrix(corpus):
+    """
+    Return the pages of `corpus` in sorted order, a sparse matrix whose
+    entry (i, j) is the probability of following a link from page j to
+    page i, and a boolean array marking the pages with no links.
+
+    A page with no links is treated as linking to every page, which is
+    left to the iteration rather than stored in the matrix.
+    """
+    pages = sorted(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+
+    sources = []
+    targets = []
+    for page, links in corpus.items():
+        i = index[page]
+        for link in links:
+            if link in index:
+                sources.append(i)
+                targets.append(index[link])
+
+    sources = np.array(sources, dtype=np.int64)
+    targets = np.array(targets, dtype=np.int64)
+    out_degree = np.bincount(sources, minlength=len(pages))
+    matrix = sparse.csr_matrix(
+        (1 / out_degree[sources], (targets, sources)),
+        shape=(len(pages), len(pages))
+    )
+    return pages, matrix, out_degree == 0
+
+
+def power_iteration(matrix, dangling, damping_factor, tolerance, ranks=None,
+                    extrapolation=None, callback=None):
+    """
+    Return the PageRank vector for a transition `matrix` as built by
+    transition_matrix, starting from `ranks` or from a uniform vector.
+
+    Each step spreads the rank of every page over its links with
+    probability `damping_factor`, and over every page otherwise. Rank
+    held by `dangling` pages is always spread over every page. This is
+    Jacobi iteration on the linear system PageRank solves.
+
+    With `extrapolation` set to "aitken" or "quadratic", every
+    EXTRAPOLATION_INTERVAL steps the last few iterates are extrapolated
+    to where they are heading, cancelling the slowest-decaying error.
+    The extrapolated vector is kept only if a step from it changes less
+    than the last step did; otherwise iteration carries on from the
+    plain iterate. Iteration stops, and `callback` is called, as for
+    iterate_pagerank.
+    """
+    n = matrix.shape[0]
+    if ranks is None:
+        ranks = np.full(n, 1 / n)
+
+    started = time.perf_counter()
+    history = deque(maxlen=4)
+    iteration = 0
+    following = None
+    while True:
+        if following is None:
+            updated = pagerank_step(matrix, dangling, damping_factor, ranks)
+        else:
+            updated = following
+            following = None
+        iteration += 1
+        residual = np.abs(updated - ranks).sum()
+        if callback is not None:
+            callback(iteration, residual, time.perf_counter() - started)
+        if residual < tolerance:
+            return updated
+        ranks = updated
+
+        history.append(ranks)
+        if extrapolation is not None and iteration % EXTRAPOLATION_INTERVAL == 0:
+            if extrapolation == "aitken":
+                guess = aitken_extrapolation(*list(history)[-3:])
+            else:
+                guess = quadratic_extrapolation(*history)
+            history.clear()
+            step = pagerank_step(matrix, dangling, damping_factor, guess)
+            if np.abs(step - guess).sum() < residual:
+                ranks = guess
+                following = step
+
+
+def pagerank_step(matrix, dangling, damping_factor, ranks):
+    """
+    Return the ranks after one step of power_iteration from `ranks`.
+    """
+    n = matrix.shape[0]
+    spread = damping_factor * ranks[dangling].sum() / n
+    return damping_factor * (matrix @ ranks) + spread + (1 - damping_factor) / n
+
+
+def aitken_extrapolation(first, second, third):
+    """
+    Return the limit of three successive iterates extrapolated page by
+    page with Aitken's delta-squared process, as a rank vector.
+    """
+    curvature = third - 2 * second + first
+    safe = np.abs(curvature) > 1e-300
+    ranks = third.copy()
+    ranks[safe] = first[safe] - (second[safe] - first[safe]) ** 2 / curvature[safe]
+    return normalized(ranks, third)
+
+
+def quadratic_extrapolation(first, second, third, fourth):
+    """
+    Return the limit of four successive iterates extrapolated on the
+    assumption that their error lies in the span of three eigenvectors,
+    as a rank vector.
+    """
+    differences = np.column_stack((second - first, third - first))
+    gammas, *_ = np.linalg.lstsq(differences, -(fourth - first), rcond=None)
+    gamma_1, gamma_2 = gammas
+    ranks = (
+        (gamma_1 + gamma_2 + 1) * second + (gamma_2 + 1) * third + fourth
+    )
+    return normalized(ranks, fourth)
+
+
+def normalized(ranks, fallback):
+    """
+    Return `ranks` made non-negative and scaled to sum to 1, or
+    `fallback` if extrapolation left nothing usable.
+    """
+    ranks = np.abs(ranks)
+    total = ranks.sum()
+    if not np.isfinite(total) or total == 0:
+        return fallback
+    return ranks / total
+
+
+def gauss_seidel(matrix, dangling, damping_factor, tolerance, ranks=None,
+                 callback=None):
+    """
+    Return the PageRank vector for a transition `matrix` as built by
+    transition_matrix, by Gauss-Seidel iteration from `ranks` or from a
+    uniform vector.
+
+    Each step updates the pages in order, using the new ranks of the
+    pages before each one as soon as they are known. This is a single
+    sparse triangular solve. The rank of `dangling` pages is spread
+    using the previous step's ranks. Iteration stops, and `callback` is
+    called, as for iterate_pagerank.
+    """
+    n = matrix.shape[0]
+    if ranks is None:
+        ranks = np.full(n, 1 / n)
+
+    # Solve (I - dD - dL) x = dU x' + b with the diagonal divided out,
+    # so the triangular factor has a unit diagonal
+    scale = 1 / (1 - damping_factor * matrix.diagonal())
+    lower = sparse.identity(n, format="csr") - sparse.diags(scale) @ (
+        damping_factor * sparse.tril(matrix, k=-1, format="csr")
+    )
+    lower = lower.tocsr()
+    upper = damping_factor * sparse.triu(matrix, k=1, format="csr")
+
+    started = time.perf_counter()
+    iteration = 0
+    while True:
+        spread = damping_factor * ranks[dangling].sum() / n
+        right = scale * (upper @ ranks + spread + (1 - damping_factor) / n)
+        ranks = spsolve_triangular(lower, right, lower=True, unit_diagonal=True)
+        ranks /= ranks.sum()
+
+        iteration += 1
+        residual = np.abs(
+            pagerank_step(matrix, dangling, damping_factor, ranks) - ranks
+        ).sum()
+        if callback is not None:
+            callback(iteration, residual, time.perf_counter() - started)
+        if residual < tolerance:
+            return ranks
+
+
+def personalized_iteration(matrix, dangling, damping_factor, jumps, tolerance,
+                           callback=None):
+    """
+    Return personalized PageRank vectors, as the columns of a matrix,
+    for a transition `matrix` as built by transition_matrix and the
+    teleport distributions in the columns of `jumps`.
+
+    Each step is a step of power_iteration for every column at once,
+    with rank jumping, and leaving `dangling` pages, according to that
+    column's distribution.
+    """
+    # Teleports usually name a few pages each, so only add those
+    rows, columns = np.nonzero(jumps)
+    weights = jumps[rows, columns]
+
+    ranks = jumps.copy()
+    started = time.perf_counter()
+    iteration = 0
+    while True:
+        stranded = damping_factor * ranks[dangling].sum(axis=0)
+        updated = matrix @ ranks
+        updated *= damping_factor
+        updated[rows, columns] += weights * (stranded + 1 - damping_factor)[columns]
+
+        iteration += 1
+        ranks -= updated
+        np.abs(ranks, out=ranks)
+        residual = ranks.sum(axis=0).max(initial=0)
+        if callback is not None:
+            callback(iteration, residual, time.perf_counter() - started)
+        if residual < tolerance:
+            return updated
+        ranks = updated
 
 
 if __name__ == "__main__":
@@ -2,219 +2,1201 @@
 Tic Tac Toe Player
 """
 
+import argparse
 import math
-import copy
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 X = "X"
 O = "O"
 EMPTY = None
 
+# The engine works on bitboards: cell (i, j) of a board with n columns
+# is bit n * i + j, and a position is a pair of masks of the cells held
+# by X and by O. A Game gives the shape of the board and how many in a
+# row win; the standard game is 3 in a row on a SIZE by SIZE board.
+SIZE = 3
+ROW_MASKS = tuple(0b111 << SIZE * i for i in range(SIZE))
+COLUMN_MASKS = tuple(0b001001001 << j for j in range(SIZE))
+DIAGONAL_MASKS = (0b100010001, 0b001010100)
+WIN_MASKS = ROW_MASKS + COLUMN_MASKS + DIAGONAL_MASKS
 
-def initial_state():
+# Boards of at most SMALL_CELLS cells are solved to the end, with tables
+# of which masks hold a line and of where each symmetry of the board
+# moves every mask. Bigger boards are searched one move deeper at a time
+# for TIME_BUDGET seconds a move, only among cells next to a piece, and
+# positions at the horizon are scored by their open lines, each worth
+# LINE_WEIGHT to the power of the pieces already on it. The clock is
+# read every CLOCK_INTERVAL nodes. Searches run in one process unless
+# given more WORKERS, which split the moves from the root between them.
+SMALL_CELLS = 12
+TIME_BUDGET = 1.0
+LINE_WEIGHT = 4
+CLOCK_INTERVAL = 256
+WORKERS = 1
+
+# Searched positions are remembered in a TranspositionTable of at most
+# TABLE_SIZE entries, evicting by one of EVICTIONS when full
+TABLE_SIZE = 1 << 16
+EVICTIONS = ("lru", "depth")
+
+# Whether a value stored in the table is exact or only bounds the value
+# of the position from below or above
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# The opening book holds a byte for every board of the standard game,
+# indexed by reading the board as a base 3 number with X as 1 and O as
+# 2. A solved position's byte has its value for X, plus 1, in the high
+# bits and its best cell in the low ones; other boards are UNSOLVED.
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tictactoe.book")
+BOOK_MAGIC = b"TTTBOOK1"
+BOOK_ENTRIES = 3 ** (SIZE * SIZE)
+UNSOLVED = 0xFF
+NO_CELL = 0x0F
+
+
+class TranspositionTable():
+    """
+    Values of positions already searched, as (value, bound, depth)
+    triples keyed by Game.key, so a position is searched once however
+    it is reached and however the board is turned. Holds at most `size`
+    entries; when full, "lru" eviction drops the least recently used
+    entry, and "depth" eviction the oldest of those searched least
+    deep, which are the cheapest to search again.
+    """
+
+    def __init__(self, size=TABLE_SIZE, eviction="lru"):
+        if eviction not in EVICTIONS:
+            raise ValueError(f"eviction must be one of {EVICTIONS}")
+        self.size = size
+        self.eviction = eviction
+        self.values = dict()
+        # Keys queued oldest first, all in one queue for "lru" and in a
+        # queue per search depth for "depth"
+        self.queues = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def lookup(self, key):
+        """
+        Returns the (value, bound, depth) triple stored for key, or None.
+        """
+        value = self.values.get(key)
+        if value is not None and self.eviction == "lru":
+            self.queues[0].move_to_end(key)
+        return value
+
+    def store(self, key, value, depth):
+        """
+        Stores the (value, bound, depth) triple of the position with key,
+        searched depth moves deep.
+        """
+        if key not in self.values:
+            if len(self.values) >= self.size:
+                self.evict()
+            queue = depth if self.eviction == "depth" else 0
+            self.queues.setdefault(queue, OrderedDict())[key] = None
+        elif self.eviction == "depth" and self.values[key][2] != depth:
+            # Searched again to a new depth, so queue it with its peers
+            del self.queues[self.values[key][2]][key]
+            self.queues.setdefault(depth, OrderedDict())[key] = None
+        self.values[key] = value
+
+    def evict(self):
+        queue = min(q for q, keys in self.queues.items() if keys)
+        key, _ = self.queues[queue].popitem(last=False)
+        del self.values[key]
+
+    def clear(self):
+        self.values.clear()
+        self.queues.clear()
+
+
+class Game():
+    """
+    An m,n,k game: a board of `rows` by `columns` cells, on which the
+    first player to hold `k` cells in a row, column or diagonal wins.
+    Each game has its own transposition table.
+    """
+
+    def __init__(self, rows, columns, k):
+        if not 1 <= k <= max(rows, columns):
+            raise ValueError("k in a row must fit on the board")
+        self.rows = rows
+        self.columns = columns
+        self.k = k
+        self.cells = rows * columns
+        self.full = (1 << self.cells) - 1
+        self.bits = tuple(1 << cell for cell in range(self.cells))
+        self.table = TranspositionTable()
+
+        # Every run of k cells, and the runs through each cell
+        lines = dict()
+        for i in range(rows):
+            for j in range(columns):
+                for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    if 0 <= i + di * (k - 1) < rows and 0 <= j + dj * (k - 1) < columns:
+                        line = sum(self.bit(i + di * s, j + dj * s) for s in range(k))
+                        lines[line] = None
+        self.lines = tuple(lines)
+        self.lines_through = tuple(
+            tuple(line for line in self.lines if line & bit) for bit in self.bits
+        )
+        self.weights = tuple(LINE_WEIGHT ** count for count in range(k + 1))
+
+        # Cells on the most lines are tried first, then those nearest
+        # the center
+        def priority(cell):
+            i, j = divmod(cell, columns)
+            distance = (i - (rows - 1) / 2) ** 2 + (j - (columns - 1) / 2) ** 2
+            return -len(self.lines_through[cell]), distance, cell
+
+        self.move_order = tuple(
+            self.bits[cell] for cell in sorted(range(self.cells), key=priority)
+        )
+        self.neighbours = tuple(
+            sum(
+                self.bit(a, b)
+                for a in range(i - 1, i + 2) for b in range(j - 1, j + 2)
+                if 0 <= a < rows and 0 <= b < columns
+            )
+            for i in range(rows) for j in range(columns)
+        )
+
+        if self.cells <= SMALL_CELLS:
+            self.winning = tuple(
+                any(mask & line == line for line in self.lines)
+                for mask in range(self.full + 1)
+            )
+            self.symmetries = self.symmetry_tables()
+        else:
+            self.winning = None
+            self.symmetries = None
+
+    def bit(self, i, j):
+        return self.bits[self.columns * i + j]
+
+    def symmetry_tables(self):
+        """
+        Returns, for each rotation and reflection that maps the board onto
+        itself, a table of where it moves every mask of cells.
+        """
+        r = self.rows - 1
+        c = self.columns - 1
+        maps = [
+            lambda i, j: (i, j), lambda i, j: (r - i, j),
+            lambda i, j: (i, c - j), lambda i, j: (r - i, c - j),
+        ]
+        if self.rows == self.columns:
+            maps += [
+                lambda i, j: (j, i), lambda i, j: (j, r - i),
+                lambda i, j: (c - j, i), lambda i, j: (c - j, r - i),
+            ]
+
+        tables = []
+        for move in maps:
+            moved = [
+                self.bit(*move(*divmod(cell, self.columns)))
+                for cell in range(self.cells)
+            ]
+            table = [0] * (self.full + 1)
+            for mask in range(1, self.full + 1):
+                low = mask & -mask
+                table[mask] = table[mask ^ low] | moved[low.bit_length() - 1]
+            tables.append(tuple(table))
+        return tuple(tables)
+
+    def key(self, xs, o_mask):
+        """
+        Returns a key for the position; on small boards it is the same
+        for every rotation and reflection of the position.
+        """
+        if self.symmetries is None:
+            return xs << self.cells | o_mask
+        return min(
+            table[xs] << self.cells | table[o_mask] for table in self.symmetries
+        )
+
+    def has_line(self, mask):
+        """
+        Returns True if the cells of mask complete a line.
+        """
+        if self.winning is not None:
+            return self.winning[mask]
+        for line in self.lines:
+            if mask & line == line:
+                return True
+        return False
+
+    def completes(self, mask, bit):
+        """
+        Returns True if the cells of mask complete a line through bit.
+        """
+        for line in self.lines_through[bit.bit_length() - 1]:
+            if mask & line == line:
+                return True
+        return False
+
+    def evaluate(self, xs, o_mask):
+        """
+        Returns an estimate of the value of the position for X, strictly
+        between -1 and 1, from the lines each player can still complete.
+        """
+        score = 0
+        weights = self.weights
+        for line in self.lines:
+            x = xs & line
+            o = o_mask & line
+            if x and not o:
+                score += weights[x.bit_count()]
+            elif o and not x:
+                score -= weights[o.bit_count()]
+        return score / (1 + abs(score))
+
+
+class GameState():
+    """
+    A position of `game`, changed in place by applying a move and undoing
+    it again. The piece counts, the moves applied and the cells next to
+    a piece are kept up to date move by move, and only the lines through
+    each new move are checked for a win, so searching never copies or
+    rescans a position.
+    """
+
+    def __init__(self, game, xs=0, o_mask=0):
+        self.game = game
+        self.xs = xs
+        self.o_mask = o_mask
+        self.x_count = xs.bit_count()
+        self.o_count = o_mask.bit_count()
+        self.pieces = self.x_count + self.o_count
+        # Whether the last move applied completed a line
+        self.won = False
+
+        # Moves applied, and the cells next to a piece after each, which
+        # only big boards need
+        self.applied = 0
+        self.history = [0] * (game.cells + 1)
+        self.nearby = [0] * (game.cells + 1)
+        self.near = game.cells > SMALL_CELLS
+        taken = xs | o_mask
+        while taken:
+            low = taken & -taken
+            self.nearby[0] |= game.neighbours[low.bit_length() - 1]
+            taken ^= low
+
+    def x_to_move(self):
+        return self.x_count == self.o_count
+
+    def last(self):
+        """
+        Returns the last move applied, as a bit, or 0 if there is none.
+        """
+        return self.history[self.applied - 1] if self.applied else 0
+
+    def apply(self, bit):
+        """
+        Takes the cell of bit for the player to move.
+        """
+        cell = bit.bit_length() - 1
+        if self.x_count == self.o_count:
+            mask = self.xs = self.xs | bit
+            self.x_count += 1
+        else:
+            mask = self.o_mask = self.o_mask | bit
+            self.o_count += 1
+        for line in self.game.lines_through[cell]:
+            if mask & line == line:
+                self.won = True
+                break
+        self.pieces += 1
+        applied = self.applied
+        self.history[applied] = bit
+        self.applied = applied + 1
+        if self.near:
+            self.nearby[applied + 1] = \
+                self.nearby[applied] | self.game.neighbours[cell]
+
+    def undo(self):
+        """
+        Takes back the last move applied.
+        """
+        self.applied -= 1
+        bit = self.history[self.applied]
+        if self.x_count > self.o_count:
+            self.xs ^= bit
+            self.x_count -= 1
+        else:
+            self.o_mask ^= bit
+            self.o_count -= 1
+        self.pieces -= 1
+        # Moves are only applied to positions that are not won
+        self.won = False
+
+    def candidates(self):
+        """
+        Returns the mask of free cells worth trying. On big boards only
+        cells next to a piece are worth trying.
+        """
+        free = self.game.full ^ (self.xs | self.o_mask)
+        if self.near and self.pieces:
+            return free & self.nearby[self.applied]
+        return free
+
+
+class Timeout(Exception):
+    """
+    Raised inside a search whose deadline has passed.
+    """
+
+
+class AlphaBeta():
+    """
+    Alpha-beta search over a GameState of `game`, reading and filling
+    `table`. Moves are tried in the game's order, after the killer move:
+    the last one that cut off the search of another position with as
+    many pieces. Positions at the depth a search is asked for are scored
+    by Game.evaluate. Once `deadline`, a time.perf_counter() value, has
+    passed, searching raises Timeout. `nodes` counts the positions
+    visited.
+    """
+
+    def __init__(self, game, table, deadline=None):
+        self.game = game
+        self.table = table
+        self.deadline = deadline
+        self.nodes = 0
+        self.killers = [0] * (game.cells + 1)
+
+    def best_cell(self, state, depth, first=None):
+        """
+        Returns the optimal cell for the player to move in state to take,
+        looking depth moves ahead and trying cell first, and the value of
+        the game for X. state is left as it was.
+        """
+        candidates = state.candidates()
+        moves = [bit for bit in self.game.move_order if bit & candidates]
+        if first is not None and self.game.bits[first] in moves:
+            moves.remove(self.game.bits[first])
+            moves.insert(0, self.game.bits[first])
+
+        best = None
+        if state.x_to_move():
+            v = -math.inf
+            for bit in moves:
+                state.apply(bit)
+                t = self.min_value(state, v, 1, depth - 1)
+                state.undo()
+                if t > v:
+                    v = t
+                    best = bit
+                if v == 1:
+                    break
+        else:
+            v = math.inf
+            for bit in moves:
+                state.apply(bit)
+                t = self.max_value(state, -1, v, depth - 1)
+                state.undo()
+                if t < v:
+                    v = t
+                    best = bit
+                if v == -1:
+                    break
+        return best.bit_length() - 1, v
+
+    def max_value(self, state, alpha, beta, depth):
+        """
+        Returns the value of the game for X, with X to move in state, or
+        a bound on it beyond the alpha to beta window.
+        """
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % CLOCK_INTERVAL == 0:
+            self.check()
+        game = self.game
+        if state.won:
+            return -1
+        if state.pieces == game.cells:
+            return 0
+        if depth <= 0:
+            return game.evaluate(state.xs, state.o_mask)
+
+        key = game.key(state.xs, state.o_mask)
+        entry = self.table.lookup(key)
+        if entry is not None and entry[2] >= depth:
+            value, bound, _ = entry
+            if bound == EXACT:
+                return value
+            elif bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        low = alpha
+        v = -math.inf
+        candidates = state.candidates()
+        killer = self.killers[state.pieces] & candidates
+        if killer:
+            state.apply(killer)
+            v = self.min_value(state, alpha, beta, depth - 1)
+            state.undo()
+            alpha = max(alpha, v)
+        if v < beta:
+            for bit in game.move_order:
+                if not bit & candidates or bit == killer:
+                    continue
+                state.apply(bit)
+                v = max(v, self.min_value(state, alpha, beta, depth - 1))
+                state.undo()
+                if v >= beta:
+                    self.killers[state.pieces] = bit
+                    break
+                alpha = max(alpha, v)
+        self.record(key, v, low, beta, depth)
+        return v
+
+    def min_value(self, state, alpha, beta, depth):
+        """
+        Returns the value of the game for X, with O to move in state, or
+        a bound on it beyond the alpha to beta window.
+        """
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % CLOCK_INTERVAL == 0:
+            self.check()
+        game = self.game
+        if state.won:
+            return 1
+        if state.pieces == game.cells:
+            return 0
+        if depth <= 0:
+            return game.evaluate(state.xs, state.o_mask)
+
+        key = game.key(state.xs, state.o_mask)
+        entry = self.table.lookup(key)
+        if entry is not None and entry[2] >= depth:
+            value, bound, _ = entry
+            if bound == EXACT:
+                return value
+            elif bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        high = beta
+        v = math.inf
+        candidates = state.candidates()
+        killer = self.killers[state.pieces] & candidates
+        if killer:
+            state.apply(killer)
+            v = self.max_value(state, alpha, beta, depth - 1)
+            state.undo()
+            beta = min(beta, v)
+        if v > alpha:
+            for bit in game.move_order:
+                if not bit & candidates or bit == killer:
+                    continue
+                state.apply(bit)
+                v = min(v, self.max_value(state, alpha, beta, depth - 1))
+                state.undo()
+                if v <= alpha:
+                    self.killers[state.pieces] = bit
+                    break
+                beta = min(beta, v)
+        self.record(key, v, alpha, high, depth)
+        return v
+
+    def check(self):
+        """
+        Raises Timeout if the search should stop.
+        """
+        if time.perf_counter() > self.deadline:
+            raise Timeout
+
+    def record(self, key, v, alpha, beta, depth):
+        """
+        Stores v, searched depth moves deep within the alpha to beta
+        window, in the table.
+        """
+        if v <= alpha:
+            bound = UPPER
+        elif v >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, (v, bound, depth), depth)
+
+
+class RootSplit():
+    """
+    Searches a position like AlphaBeta.best_cell, with the first move
+    from the root searched on its own and then each of the others in its
+    own task on a pool of `workers` processes, only to find whether it
+    beats the first. Once a move is found to win, the moves after it in
+    the order tried are cut off. Every task starts from an empty table,
+    so the move chosen does not depend on how the tasks were scheduled.
+    If `counting`, the workers count as a Counting search does, and the
+    counts are added up. The pool is shared with every other RootSplit
+    of the same game and workers, and is kept between searches.
+    """
+
+    def __init__(self, game, workers, deadline=None, counting=False):
+        self.game = game
+        self.deadline = deadline
+        self.counting = counting
+        self.nodes = 0
+        self.reached = 0
+        self.hits = 0
+        self.misses = 0
+        self.cutoffs = 0
+        self.pool, self.win = split_pool(game, workers)
+
+    def best_cell(self, state, depth, first=None):
+        """
+        Returns the optimal cell for the player to move in state to take,
+        looking depth moves ahead and trying cell first, and the value of
+        the game for X.
+        """
+        candidates = state.candidates()
+        cells = [
+            bit.bit_length() - 1 for bit in self.game.move_order
+            if bit & candidates
+        ]
+        if first is not None and first in cells:
+            cells.remove(first)
+            cells.insert(0, first)
+
+        sign = 1 if state.x_to_move() else -1
+        self.win.value = len(cells)
+        results = [self.pool.apply(split_move, (
+            (0, state.xs, state.o_mask, cells[0], depth, -1, 1,
+             self.deadline, self.counting),
+        ))]
+
+        # The other moves only need searching for whether they beat the
+        # first, so its value bounds their window as in a serial search
+        first = results[0][0]
+        if first is not None and first != sign and len(cells) > 1:
+            alpha, beta = (first, 1) if sign == 1 else (-1, first)
+            tasks = [
+                (index, state.xs, state.o_mask, cell, depth, alpha, beta,
+                 self.deadline, self.counting)
+                for index, cell in enumerate(cells) if index > 0
+            ]
+            results += self.pool.map(split_move, tasks, chunksize=1)
+
+        best = None
+        for index, (value, nodes, counts) in enumerate(results):
+            self.nodes += nodes
+            if counts is not None:
+                reached, hits, misses, cutoffs = counts
+                self.reached = max(self.reached, reached)
+                self.hits += hits
+                self.misses += misses
+                self.cutoffs += cutoffs
+            if index > self.win.value:
+                continue
+            if value is None:
+                raise Timeout
+            if best is None or sign * value > sign * v:
+                best = cells[index]
+                v = value
+        return best, v
+
+    def counts(self):
+        return self.reached, self.hits, self.misses, self.cutoffs
+
+
+class SplitSearch(AlphaBeta):
+    """
+    Searches the move at `index` in the order a RootSplit tried them,
+    giving up once a move before it is found to win.
+    """
+
+    def __init__(self, game, table, deadline, index):
+        super().__init__(game, table, math.inf if deadline is None else deadline)
+        self.index = index
+
+    def check(self):
+        super().check()
+        if split_win.value < self.index:
+            raise Timeout
+
+
+class Counting():
+    """
+    Mixed into an AlphaBeta search to count, as well as its nodes, the
+    most moves ahead of the root it reached, its table hits and misses,
+    and its cutoffs: searches of a position before the horizon that
+    ended at or beyond the bound of the window in favour of the player
+    to move, so that the move before was refuted.
+    """
+
+    def __init__(self, game, table, *args):
+        super().__init__(game, CountingTable(table), *args)
+        self.reached = 0
+        self.cutoffs = 0
+
+    def counts(self):
+        """
+        Returns the most moves ahead reached, the table hits and misses,
+        and the cutoffs.
+        """
+        return self.reached, self.table.hits, self.table.misses, self.cutoffs
+
+    def max_value(self, state, alpha, beta, depth):
+        if state.applied > self.reached:
+            self.reached = state.applied
+        v = super().max_value(state, alpha, beta, depth)
+        if v >= beta and depth > 0 and not self.over(state):
+            self.cutoffs += 1
+        return v
+
+    def min_value(self, state, alpha, beta, depth):
+        if state.applied > self.reached:
+            self.reached = state.applied
+        v = super().min_value(state, alpha, beta, depth)
+        if v <= alpha and depth > 0 and not self.over(state):
+            self.cutoffs += 1
+        return v
+
+    def over(self, state):
+        return state.won or state.pieces == self.game.cells
+
+
+class CountingAlphaBeta(Counting, AlphaBeta):
+    pass
+
+
+class CountingSplitSearch(Counting, SplitSearch):
+    pass
+
+
+class CountingTable():
+    """
+    Passes lookups and stores on to `table`, counting which lookups hit.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        entry = self.table.lookup(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, key, value, depth):
+        self.table.store(key, value, depth)
+
+
+# The game searched by a RootSplit worker, and the index of the first
+# root move found to win, shared between the workers
+split_game = None
+split_win = None
+
+# The pool and shared win index of every RootSplit, by the rows, columns
+# and k of its game and its number of workers
+split_pools = {}
+
+def split_pool(game, workers):
+    """
+    Returns the pool of workers processes searching game for a
+    RootSplit, and the index they share, starting them on first use.
+    """
+    key = (game.rows, game.columns, game.k, workers)
+    if key not in split_pools:
+        win = multiprocessing.Value("i", 0)
+        pool = multiprocessing.Pool(
+            workers, start_worker, (game.rows, game.columns, game.k, win)
+        )
+        split_pools[key] = pool, win
+    return split_pools[key]
+
+def start_worker(rows, columns, k, win):
+    global split_game, split_win
+    split_game = Game(rows, columns, k)
+    split_win = win
+
+def split_move(task):
+    """
+    Returns the value for X of taking a cell, searched from an empty
+    table within the alpha to beta window, how many nodes were searched,
+    and the counts of a Counting search if asked for. The value is None
+    if the search was cut off.
+    """
+    index, xs, o_mask, cell, depth, alpha, beta, deadline, counting = task
+    if split_win.value < index or \
+            deadline is not None and time.perf_counter() > deadline:
+        return None, 0, None
+
+    state = GameState(split_game, xs, o_mask)
+    x_moves = state.x_to_move()
+    searcher = (CountingSplitSearch if counting else SplitSearch)(
+        split_game, TranspositionTable(), deadline, index
+    )
+    state.apply(split_game.bits[cell])
+    try:
+        if x_moves:
+            value = searcher.min_value(state, alpha, beta, depth - 1)
+        else:
+            value = searcher.max_value(state, alpha, beta, depth - 1)
+    except Timeout:
+        value = None
+
+    if value == (1 if x_moves else -1):
+        with split_win.get_lock():
+            split_win.value = min(split_win.value, index)
+    return value, searcher.nodes, searcher.counts() if counting else None
+
+
+class SearchStats():
+    """
+    Collects how each move was chosen while collect_stats is active.
+    `moves` holds a dict per move with the nodes searched, the most
+    moves ahead reached, the table hits and misses and the cutoffs, as
+    counted by a Counting search, the seconds taken, and whether the
+    move came from the opening book. `callback`, if given, is called
+    with each dict as it is recorded.
+    """
+
+    def __init__(self, callback=None):
+        self.moves = []
+        self.callback = callback
+
+    def record(self, **move):
+        self.moves.append(move)
+        if self.callback is not None:
+            self.callback(move)
+
+    def totals(self):
+        """
+        Returns a dict of the counts added up over every move, with the
+        most moves ahead any search reached.
+        """
+        totals = dict.fromkeys(
+            ("moves", "nodes", "reached", "hits", "misses", "cutoffs", "seconds"), 0
+        )
+        for move in self.moves:
+            totals["moves"] += 1
+            for name in ("nodes", "hits", "misses", "cutoffs", "seconds"):
+                totals[name] += move[name]
+            totals["reached"] = max(totals["reached"], move["reached"])
+        return totals
+
+
+STANDARD = Game(SIZE, SIZE, SIZE)
+
+# Shared by every search of the standard game, so positions solved for
+# one move are not solved again for the next; replace it to change its
+# size or eviction
+transpositions = TranspositionTable()
+
+# The opening book, once opening_book has read it
+book = None
+
+# The SearchStats being collected, if any. Searches only count when it is
+# set, by collect_stats, and otherwise cost nothing extra.
+stats = None
+
+# Base 3 index of every mask of cells of the standard board, with each
+# cell counted as a 1
+TERNARY = tuple(
+    sum(3 ** cell for cell in range(STANDARD.cells) if mask & STANDARD.bits[cell])
+    for mask in range(STANDARD.full + 1)
+)
+
+
+def initial_state(game=STANDARD):
     """
     Returns starting state of the board.
     """
-    return [[EMPTY, EMPTY, EMPTY],
-            [EMPTY, EMPTY, EMPTY],
-            [EMPTY, EMPTY, EMPTY]]
+    return [[EMPTY] * game.columns for _ in range(game.rows)]
 
-def player(board):
+def player(board, game=STANDARD):
     """
     Returns player who has the next turn on a board.
     """
-    game_over = "The game is already over"
+    if terminal(board, game):
+        return "The game is already over"
+    return masks_player(*to_masks(board))
 
-    o_moves = []
-    x_moves = []
-    if terminal(board):
-        return game_over
-    elif board == initial_state():
-        x_moves.append(X)
-        return X
-    else:
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == X:
-                    x_moves.append(X)
-                elif board[i][j] == O:
-                    o_moves.append(O)
-
-        if len(x_moves) > len(o_moves):
-            return O
-        elif len(x_moves) == len(o_moves):
-            return X
-
-def actions(board):
+def actions(board, game=STANDARD):
     """
     Returns set of all possible actions (i, j) available on the board.
     """
-    game_over = "The game is already over"
-    action = set()
-    if terminal(board):
-        return game_over
-    else:
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == EMPTY:
-                    action.add((i, j))
+    if terminal(board, game):
+        return "The game is already over"
+    xs, o_mask = to_masks(board)
+    return set(divmod(cell, game.columns) for cell in masks_actions(xs, o_mask, game))
 
-    return action
-
-def result(board, action):
+def result(board, action, game=STANDARD):
     """
     Returns the board that results from making move (i, j) on the board.
     """
     i = action[0]
     j = action[1]
-    board_copy = copy.deepcopy(board)
+    if not (0 <= i < game.rows and 0 <= j < game.columns):
+        raise Exception("Invalid action!")
+    xs, o_mask = to_masks(board)
+    bit = game.bit(i, j)
 
-    if board[i][j] == EMPTY:
-        board_copy[i][j] = player(board_copy)
-        return board_copy
-    else:
+    if (xs | o_mask) & bit:
         raise Exception("Invalid action!")
+    if masks_player(xs, o_mask) == X:
+        return to_board(xs | bit, o_mask, game)
+    return to_board(xs, o_mask | bit, game)
 
-def winner(board):
+def winner(board, game=STANDARD):
     """
     Returns the winner of the game, if there is one.
     """
+    return masks_winner(*to_masks(board), game.lines)
 
-    if horizontal_win_check(board) == X:
-        return X
-    elif horizontal_win_check(board) == O:
-        return O
-
-    if vertical_win_check(board) == X:
-        return X
-    elif vertical_win_check(board) == O:
-        return O
-
-    if diagonal_win_check(board) == X:
-        return X
-    elif diagonal_win_check(board) == O:
-        return O
-
-    else:
-        return EMPTY
-
-def terminal(board):
+def terminal(board, game=STANDARD):
     """
     Returns True if game is over, False otherwise.
     """
-    list_empty = []
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] == EMPTY:
-                list_empty.append(EMPTY)
-
-    if winner(board) == X:
-        return True
-    elif winner(board) == O:
-        return True
-    elif len(list_empty) == 0:
-        return True
-    else:
-        return False
+    return masks_terminal(*to_masks(board), game)
 
-def utility(board):
+def utility(board, game=STANDARD):
     """
     Returns 1 if X has won the game, -1 if O has won, 0 otherwise.
     """
-    if winner(board) == X:
+    xs, o_mask = to_masks(board)
+    if game.has_line(xs):
         return 1
-    elif winner(board) == O:
+    elif game.has_line(o_mask):
         return -1
     else:
         return 0
 
-def minimax(board):
+def minimax(board, game=STANDARD, budget=None, workers=None):
     """
     Returns the optimal action for the current player on the board.
     """
-    opt_action = ()
-    if terminal(board):
-        return EMPTY
+    return search(board, game, budget, workers)[0]
+
+def search(board, game=STANDARD, budget=None, workers=None):
+    """
+    Returns the optimal action for the current player on the board,
+    the value of the game for X, and how many nodes were searched.
+
+    The standard game is answered from the opening book when there is
+    one. Otherwise the search is as for search_masks.
+    """
+    xs, o_mask = to_masks(board)
+    if masks_terminal(xs, o_mask, game):
+        return EMPTY, utility(board, game), 0
+
+    if game is STANDARD:
+        started = time.perf_counter()
+        entry = opening_book()[TERNARY[xs] + 2 * TERNARY[o_mask]]
+        if entry != UNSOLVED:
+            if stats is not None:
+                stats.record(
+                    nodes=0, reached=0, hits=0, misses=0, cutoffs=0,
+                    seconds=time.perf_counter() - started, book=True
+                )
+            return divmod(entry & NO_CELL, SIZE), (entry >> 4) - 1, 0
+        table = transpositions
     else:
-        if player(board) == X:
-            v = -math.inf
-            for action in actions(board):
-                t = min_value(result(board, action))
-                if t == 1:
-                    opt_action = action
-                if t > v:
-                    v = t
-                    opt_action = action
+        table = game.table
+
+    cell, value, nodes, _ = search_masks(game, xs, o_mask, budget, table, workers)
+    return divmod(cell, game.columns), value, nodes
+
+def search_masks(game, xs, o_mask, budget=None, table=None, workers=None):
+    """
+    Returns the best cell for the current player, the value of the game
+    for X, how many nodes were searched and how many moves ahead.
+
+    Boards of at most SMALL_CELLS cells are searched to the end unless
+    given a `budget`. Otherwise the search looks one move further ahead
+    at a time until `budget` seconds, TIME_BUDGET by default, run out,
+    and the last search to finish decides. `table` defaults to the
+    game's own. With more than one of `workers`, WORKERS by default,
+    the moves from the root are split between that many processes by a
+    RootSplit, which keeps its processes but no table between searches.
+    """
+    started = time.perf_counter()
+    table = game.table if table is None else table
+    workers = WORKERS if workers is None else workers
+    state = GameState(game, xs, o_mask)
+    empty = game.cells - state.pieces
+    counting = stats is not None
+    if workers > 1:
+        searcher = RootSplit(game, workers, counting=counting)
+    elif counting:
+        searcher = CountingAlphaBeta(game, table)
+    else:
+        searcher = AlphaBeta(game, table)
+    if budget is None and game.cells <= SMALL_CELLS:
+        cell, value = searcher.best_cell(state, empty)
+        reached = empty
+    else:
+        deadline = started + (TIME_BUDGET if budget is None else budget)
+        cell = None
+        value = 0
+        reached = 0
+        for depth in range(1, empty + 1):
+            # Always finish looking one move ahead, to have some move
+            searcher.deadline = deadline if depth > 1 else None
+            try:
+                cell, value = searcher.best_cell(state, depth, cell)
+            except Timeout:
+                break
+            reached = depth
+            if abs(value) == 1:
+                break
+
+    if counting:
+        deepest, hits, misses, cutoffs = searcher.counts()
+        stats.record(
+            nodes=searcher.nodes, reached=deepest, hits=hits, misses=misses,
+            cutoffs=cutoffs, seconds=time.perf_counter() - started, book=False
+        )
+    return cell, value, searcher.nodes, reached
+
+@contextmanager
+def collect_stats(callback=None):
+    """
+    Collects how each move is chosen, by search or from the opening
+    book, within the with block, into the SearchStats it yields.
+    `callback`, if given, is called with each move's dict as well.
+    """
+    global stats
+    previous = stats
+    stats = SearchStats(callback)
+    try:
+        yield stats
+    finally:
+        stats = previous
 
+def opening_book():
+    """
+    Returns the opening book, reading it from BOOK_FILE the first time.
+    If there is no usable book every board is UNSOLVED, and is searched.
+    """
+    global book
+    if book is None:
+        try:
+            with open(BOOK_FILE, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        if data[:len(BOOK_MAGIC)] == BOOK_MAGIC and \
+                len(data) == len(BOOK_MAGIC) + BOOK_ENTRIES:
+            book = data[len(BOOK_MAGIC):]
         else:
-            v = math.inf
-            for action in actions(board):
-                t = max_value(result(board, action))
-                if t == -1:
-                    opt_action = action
-                if t < v:
-                    v = t
-                    opt_action = action
+            book = bytes([UNSOLVED]) * BOOK_ENTRIES
+    return book
 
-    return opt_action
+def build_book(path=BOOK_FILE):
+    """
+    Solves every position of the standard game reachable from the
+    initial state and writes the opening book to path. Returns how many
+    positions were solved.
+
+    Positions are solved by retrograde analysis: the game over ones by
+    their outcome, then the rest from those with the most pieces to the
+    fewest, each from the already solved positions one move later.
+    Among equally good moves, the first in the game's move order is
+    chosen.
+    """
+    game = STANDARD
+
+    # Find every reachable position, grouped by how many pieces it has
+    layers = [{(0, 0)}]
+    for pieces in range(game.cells):
+        layer = set()
+        for xs, o_mask in layers[-1]:
+            if masks_terminal(xs, o_mask, game):
+                continue
+            for cell in masks_actions(xs, o_mask, game):
+                if pieces % 2 == 0:
+                    layer.add((xs | game.bits[cell], o_mask))
+                else:
+                    layer.add((xs, o_mask | game.bits[cell]))
+        layers.append(layer)
+
+    entries = bytearray([UNSOLVED]) * BOOK_ENTRIES
+    values = dict()
+    for pieces in reversed(range(len(layers))):
+        for xs, o_mask in layers[pieces]:
+            if game.winning[xs]:
+                value, best = 1, None
+            elif game.winning[o_mask]:
+                value, best = -1, None
+            elif xs | o_mask == game.full:
+                value, best = 0, None
+            else:
+                x_to_move = pieces % 2 == 0
+                value, best = None, None
+                for bit in game.move_order:
+                    if (xs | o_mask) & bit:
+                        continue
+                    child = values[(xs | bit, o_mask) if x_to_move else (xs, o_mask | bit)]
+                    if value is None or (child > value if x_to_move else child < value):
+                        value, best = child, bit
+            values[(xs, o_mask)] = value
+            cell = NO_CELL if best is None else best.bit_length() - 1
+            entries[TERNARY[xs] + 2 * TERNARY[o_mask]] = (value + 1) << 4 | cell
+
+    write_book(path, entries)
+    return len(values)
+
+def write_book(path, entries):
+    """
+    Writes the opening book entries to path, replacing any book there.
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(BOOK_MAGIC)
+        f.write(entries)
+    os.replace(temporary, path)
 
 def max_value(board):
     if terminal(board):
         return utility(board)
-    v = -math.inf
-    for action in actions(board):
-        v = max(v, min_value(result(board, action)))
-    return v
+    return AlphaBeta(STANDARD, transpositions).max_value(
+        GameState(STANDARD, *to_masks(board)), -math.inf, math.inf, STANDARD.cells
+    )
 
 def min_value(board):
     if terminal(board):
         return utility(board)
-    v = math.inf
-    for action in actions(board):
-        v = min(v, max_value(result(board, action)))
-    return v
+    return AlphaBeta(STANDARD, transpositions).min_value(
+        GameState(STANDARD, *to_masks(board)), -math.inf, math.inf, STANDARD.cells
+    )
 
 def horizontal_win_check(board):
-    if board[0][0] == board[0][1] == board[0][2] == X:
-        return X
-    elif board[0][0] == board[0][1] == board[0][2] == O:
-        return O
+    return masks_winner(*to_masks(board), ROW_MASKS)
 
-    if board[1][0] == board[1][1] == board[1][2] == X:
-        return X
-    elif board[1][0] == board[1][1] == board[1][2] == O:
-        return O
+def vertical_win_check(board):
+    return masks_winner(*to_masks(board), COLUMN_MASKS)
 
-    if board[2][0] == board[2][1] == board[2][2] == X:
-        return X
-    elif board[2][0] == board[2][1] == board[2][2] == O:
-        return O
+def diagonal_win_check(board):
+    return masks_winner(*to_masks(board), DIAGONAL_MASKS)
 
-def vertical_win_check(board):
-    if board[0][0] == board[1][0] == board[2][0] == X:
-        return X
-    elif board[0][0] == board[1][0] == board[2][0] == O:
-        return O
+def to_masks(board):
+    """
+    Returns the masks of the cells held by X and by O on a board.
+    """
+    xs = 0
+    o_mask = 0
+    cell = 0
+    for row in board:
+        for square in row:
+            if square == X:
+                xs |= 1 << cell
+            elif square == O:
+                o_mask |= 1 << cell
+            cell += 1
+    return xs, o_mask
 
-    if board[0][1] == board[1][1] == board[2][1] == X:
-        return X
-    elif board[0][1] == board[1][1] == board[2][1] == O:
-        return O
+def to_board(xs, o_mask, game=STANDARD):
+    """
+    Returns the board with the cells of mask xs held by X and of mask
+    o_mask held by O.
+    """
+    return [[X if xs & game.bit(i, j) else O if o_mask & game.bit(i, j) else EMPTY
+             for j in range(game.columns)]
+            for i in range(game.rows)]
 
-    if board[0][2] == board[1][2] == board[2][2] == X:
-        return X
-    elif board[0][2] == board[1][2] == board[2][2] == O:
-        return O
+def masks_winner(xs, o_mask, lines=WIN_MASKS):
+    """
+    Returns the player who completes one of lines, if there is one.
+    """
+    for line in lines:
+        if xs & line == line:
+            return X
+        elif o_mask & line == line:
+            return O
+    return EMPTY
 
-def diagonal_win_check(board):
-    if board[0][0] == board[1][1] == board[2][2] == X:
-        return X
-    elif board[0][0] == board[1][1] == board[2][2] == O:
-        return O
+def masks_terminal(xs, o_mask, game=STANDARD):
+    """
+    Returns True if the game is over.
+    """
+    return xs | o_mask == game.full or game.has_line(xs) or game.has_line(o_mask)
 
-    if board[0][2] == board[1][1] == board[2][0] == X:
-        return X
-    elif board[0][2] == board[1][1] == board[2][0] == O:
-        return O
+def masks_player(xs, o_mask):
+    """
+    Returns player who has the next turn.
+    """
+    return X if xs.bit_count() == o_mask.bit_count() else O
+
+def masks_actions(xs, o_mask, game=STANDARD):
+    """
+    Returns the free cells, in order.
+    """
+    taken = xs | o_mask
+    return [cell for cell, bit in enumerate(game.bits) if not taken & bit]
 
 
+def compare_split(game, depth, workers):
+    """
+    Searches the empty board of game depth moves ahead in one process
+    and split between workers processes, and prints how long each took.
+    """
+    state = GameState(game)
+    for name, searcher in (
+        ("serial", AlphaBeta(game, TranspositionTable())),
+        (f"{workers} workers", RootSplit(game, workers)),
+    ):
+        start = time.perf_counter()
+        cell, value = searcher.best_cell(state, depth)
+        elapsed = time.perf_counter() - start
+        if name == "serial":
+            serial = elapsed
+        print(
+            f"{name}: cell {divmod(cell, game.columns)}, value {value:.3f}, "
+            f"{searcher.nodes} nodes, {elapsed:.3f}s, "
+            f"speedup {serial / elapsed:.2f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Tic Tac Toe engine tools.")
+    parser.add_argument(
+        "--build-book", action="store_true",
+        help=f"solve every position and write the opening book to {BOOK_FILE}"
+    )
+    parser.add_argument(
+        "--compare-split", nargs=3, type=int, metavar=("ROWS", "COLUMNS", "K"),
+        help="time a serial and a parallel search of an empty board"
+    )
+    parser.add_argument(
+        "--depth", type=int, default=4,
+        help="moves ahead to search when comparing"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(),
+        help="processes to split the search between when comparing"
+    )
+    args = parser.parse_args()
+
+    if args.build_book:
+        positions = build_book()
+        print(f"Solved {positions} positions into {BOOK_FILE}")
+    elif args.compare_split:
+        compare_split(Game(*args.compare_split), args.depth, args.workers)
+    else:
+        parser.print_help()
+
 
+if __name__ == "__main__":
+    main()